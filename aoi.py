@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+
+ areas of interest for polygon aware harvests. an area answers two questions:
+
+    intersects([west, south, east, north]) : may the box hold photos inside the area
+    contains(lon, lat)                     : is the photo inside the area
+
+ PolygonArea is pure python so the command line can use it; the plugin wraps a
+ prepared QgsGeometry with the same interface
+"""
+
+import json
+
+from .constants import AOI_BANDS
+
+
+def _segments_cross(p1, p2, q1, q2):
+    def orient(a, b, c):
+        val = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        return (val > 0) - (val < 0)
+
+    def on_segment(a, b, c):
+        return min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= c[1] <= max(a[1], b[1])
+
+    o1, o2 = orient(p1, p2, q1), orient(p1, p2, q2)
+    o3, o4 = orient(q1, q2, p1), orient(q1, q2, p2)
+    if o1 != o2 and o3 != o4:
+        return True
+    return (o1 == 0 and on_segment(p1, p2, q1)) or (o2 == 0 and on_segment(p1, p2, q2)) or \
+        (o3 == 0 and on_segment(q1, q2, p1)) or (o4 == 0 and on_segment(q1, q2, p2))
+
+
+class PolygonArea:
+    '''
+        (multi)polygon area of interest in lon/lat
+
+        polygons is a list of polygons, each a list of rings (exterior first, then
+        holes), each a list of (lon, lat). edges are indexed in AOI_BANDS horizontal
+        bands so a point or box test only looks at the edges near it
+    '''
+    def __init__(self, polygons, bands=AOI_BANDS):
+        self.edges = []
+        xs, ys = [], []
+        for polygon in polygons:
+            for ring in polygon:
+                points = [tuple(point[:2]) for point in ring]
+                if points[0] != points[-1]:
+                    points.append(points[0])
+                for a, b in zip(points, points[1:]):
+                    if a != b:
+                        self.edges.append((a, b))
+                xs.extend(x for x, y in points)
+                ys.extend(y for x, y in points)
+
+        if len(self.edges) == 0:
+            raise ValueError("area of interest has no polygon")
+
+        self.extent = [min(xs), min(ys), max(xs), max(ys)]
+
+        # band i covers latitudes from S + i * height to S + (i + 1) * height
+        S, N = self.extent[1], self.extent[3]
+        self._height = (N - S) / bands or 1.0
+        self._bands = [[] for _ in range(bands)]
+        for edge in self.edges:
+            for band in range(self._band(min(edge[0][1], edge[1][1])), self._band(max(edge[0][1], edge[1][1])) + 1):
+                self._bands[band].append(edge)
+
+    def _band(self, lat):
+        return min(max(int((lat - self.extent[1]) / self._height), 0), len(self._bands) - 1)
+
+    def contains(self, lon, lat):
+        W, S, E, N = self.extent
+        if not (W <= lon <= E and S <= lat <= N):
+            return False
+
+        # even-odd ray casting to the east, over the edges of one band
+        inside = False
+        for (x1, y1), (x2, y2) in self._bands[self._band(lat)]:
+            if (y1 > lat) != (y2 > lat):
+                if lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+        return inside
+
+    def intersects(self, bbox):
+        W, S, E, N = bbox[:4]
+        aW, aS, aE, aN = self.extent
+        if W > aE or E < aW or S > aN or N < aS:
+            return False
+
+        # box corner inside the area
+        corners = [(W, S), (E, S), (E, N), (W, N)]
+        if any(self.contains(x, y) for x, y in corners):
+            return True
+
+        sides = list(zip(corners, corners[1:] + corners[:1]))
+        for band in range(self._band(S), self._band(N) + 1):
+            for a, b in self._bands[band]:
+                # area vertex inside the box
+                if W <= a[0] <= E and S <= a[1] <= N:
+                    return True
+                # area edge crossing a side of the box
+                if max(a[0], b[0]) < W or min(a[0], b[0]) > E or max(a[1], b[1]) < S or min(a[1], b[1]) > N:
+                    continue
+                if any(_segments_cross(a, b, c, d) for c, d in sides):
+                    return True
+        return False
+
+
+def clip_boundary(boundary, area):
+    '''
+        shrinks a boundary [west, south, east, north, startDate, endDate] to the extent of an area
+
+        Returns:
+            the clipped boundary; None if the area lies outside of it
+    '''
+    W, S, E, N = boundary[:4]
+    aW, aS, aE, aN = area.extent
+    W, S, E, N = max(W, aW), max(S, aS), min(E, aE), min(N, aN)
+    if W > E or S > N:
+        return None
+    return [W, S, E, N] + list(boundary[4:])
+
+
+def _polygons(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    raise ValueError(f"{geometry['type']} is not a polygon")
+
+
+def load_geojson(path):
+    '''
+        area of interest from the polygons of a GeoJSON file in lon/lat
+    '''
+    with open(path) as f:
+        data = json.load(f)
+
+    if data['type'] == 'FeatureCollection':
+        geometries = [feature['geometry'] for feature in data['features'] if feature.get('geometry')]
+    elif data['type'] == 'Feature':
+        geometries = [data['geometry']]
+    else:
+        geometries = [data]
+
+    polygons = []
+    for geometry in geometries:
+        polygons.extend(_polygons(geometry))
+    return PolygonArea(polygons)
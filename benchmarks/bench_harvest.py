@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+
+ reproducible harvest benchmarks against the local fake flickr API; run from the plugins folder:
+
+    python -m flickr.benchmarks.bench_harvest --sizes 10000 100000 1000000 --densities uniform hotspot temporal
+
+ every case runs the fake server and the harvest in separate processes so the
+ reported peak memory belongs to the harvest alone. Worker.run is a thin Qt
+ adapter over Harvester.run, so the harvester is measured directly.
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import multiprocessing
+from urllib.request import urlopen
+
+from .fake_flickr import FakeFlickrServer, Dataset, DENSITIES, EXTENT, START_DATE, END_DATE
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+
+def _peak_memory_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _serve(size, density, seed, latency, errorRate, conn):
+    server = FakeFlickrServer(("127.0.0.1", 0), Dataset(size, density, seed), \
+                              latency=latency, errorRate=errorRate, seed=seed)
+    conn.send(server.url)
+    server.serve_forever()
+
+
+def _harvest(url, saveImages, keys, keyRate, cursor, queue):
+    from ..harvester import Harvester
+
+    with tempfile.TemporaryDirectory() as workdir:
+        boundary = EXTENT + [START_DATE, END_DATE]
+        apiKeys = [f"benchmark{i}" for i in range(keys)]
+        harvester = Harvester(boundary, apiKeys, os.path.join(workdir, "photos.csv"), workdir, saveImages, \
+                              useCache=False, keyRate=keyRate, cursor=cursor)
+        harvester.API_URL = f"{url}/services/rest/"
+        harvester.STATIC_URL = f"{url}/static"
+
+        start = time.perf_counter()
+        df = harvester.run()
+        wall = time.perf_counter() - start
+
+        queue.put({
+            "photos": len(df),
+            "depth": harvester.maxDepth,
+            "wall_time": wall,
+            "peak_memory_mb": _peak_memory_mb()
+        })
+
+
+def run_case(size, density, seed=0, latency=0.0, errorRate=0.0, saveImages=False, keys=1, keyRate=None, cursor=False):
+    '''
+        benchmarks one harvest and returns its report
+    '''
+    ctx = multiprocessing.get_context("spawn")
+
+    parentConn, childConn = ctx.Pipe()
+    server = ctx.Process(target=_serve, args=(size, density, seed, latency, errorRate, childConn), daemon=True)
+    server.start()
+
+    try:
+        url = parentConn.recv()
+
+        queue = ctx.Queue()
+        harvest = ctx.Process(target=_harvest, args=(url, saveImages, keys, keyRate, cursor, queue))
+        harvest.start()
+        harvest.join()
+        if harvest.exitcode != 0:
+            raise RuntimeError(f"harvest of {size} {density} photos failed")
+        report = queue.get()
+
+        with urlopen(f"{url}/stats") as r:
+            counters = json.loads(r.read())
+    finally:
+        server.terminate()
+        server.join()
+
+    report.update({
+        "size": size,
+        "density": density,
+        "keys": keys,
+        "search_requests": counters.get("flickr.photos.search", 0),
+        "profile_requests": counters.get("flickr.profile.getProfile", 0),
+        "image_requests": counters.get("static", 0),
+        "requests": sum(val for key, val in counters.items() if key != "bytes")
+    })
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="flickr.benchmarks.bench_harvest", description="offline harvest benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--densities", choices=DENSITIES, nargs="+", default=list(DENSITIES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a failed API call")
+    parser.add_argument("--save-images", action="store_true")
+    parser.add_argument("--keys", type=int, default=1, help="number of API keys harvesting in parallel")
+    parser.add_argument("--cursor", action="store_true", help="walk boxes by date taken instead of page numbers")
+    parser.add_argument("--key-rate", type=int, help="hourly request budget of every key; unlimited by default")
+    parser.add_argument("--json", help="write the reports to this file")
+    args = parser.parse_args(argv)
+
+    columns = ["size", "density", "keys", "photos", "requests", "search_requests", "depth", "wall_time", "peak_memory_mb"]
+    print("  ".join(f"{column:>15}" for column in columns))
+
+    reports = []
+    for size in args.sizes:
+        for density in args.densities:
+            report = run_case(size, density, args.seed, args.latency, args.error_rate, args.save_images, \
+                              args.keys, args.key_rate, args.cursor)
+            reports.append(report)
+
+            cells = []
+            for column in columns:
+                val = report[column]
+                cells.append(f"{val:>15.2f}" if isinstance(val, float) else f"{str(val):>15}")
+            print("  ".join(cells), flush=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
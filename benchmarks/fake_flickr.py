@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+
+ local stand-in for the parts of the flickr API used by the harvester:
+
+    /services/rest/?method=flickr.test.echo
+    /services/rest/?method=flickr.photos.search
+    /services/rest/?method=flickr.profile.getProfile
+    /static/{server}/{id}_{secret}{suffix}.jpg
+    /stats                                      request counters (not part of flickr)
+
+ photos are synthetic and generated from a seed so every run sees the same data
+"""
+
+import json
+import math
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict, Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+DENSITIES = ("uniform", "hotspot", "temporal")
+
+# extent every dataset is generated in; [west, south, east, north]
+EXTENT = [88.0, 22.0, 89.0, 23.0]
+START_DATE = datetime(2015, 1, 1)
+END_DATE = datetime(2023, 1, 1)
+
+# flickr policy: default and maximum page size, and at most 4000 results served per query
+DEFAULT_PER_PAGE = 100
+MAX_PER_PAGE = 500
+MAX_RESULTS = 4000
+
+# photos are bucketed into a GRID x GRID spatial index
+GRID = 128
+
+PHOTOS_PER_OWNER = 50
+
+
+class Dataset:
+    '''
+        synthetic photo collection with a grid index
+
+        density:
+            uniform  : photos spread evenly over the extent and the date range
+            hotspot  : most photos in a few tight urban clusters
+            temporal : photos spread evenly in space but bunched towards the end of the date range
+    '''
+    def __init__(self, size, density="uniform", seed=0):
+        if density not in DENSITIES:
+            raise ValueError(f"unknown density {density}")
+
+        self.size = size
+        self.density = density
+
+        rng = random.Random(seed)
+        W, S, E, N = EXTENT
+        start, end = START_DATE.timestamp(), END_DATE.timestamp()
+
+        # column store keeps a million photos at a few tens of megabytes
+        self.lon = array('d')
+        self.lat = array('d')
+        self.ts = array('d')
+
+        hotspots = [(rng.uniform(W, E), rng.uniform(S, N), rng.uniform(0.002, 0.02)) for _ in range(5)]
+
+        for _ in range(size):
+            if density == "hotspot" and rng.random() < 0.8:
+                x, y, sigma = rng.choice(hotspots)
+                lon = min(max(rng.gauss(x, sigma), W), E)
+                lat = min(max(rng.gauss(y, sigma), S), N)
+            else:
+                lon, lat = rng.uniform(W, E), rng.uniform(S, N)
+
+            if density == "temporal":
+                t = end - (end - start) * rng.random() ** 4
+            else:
+                t = rng.uniform(start, end)
+
+            self.lon.append(lon)
+            self.lat.append(lat)
+            # flickr reports date taken with second resolution
+            self.ts.append(float(int(t)))
+
+        self.cells = dict()
+        for i in range(size):
+            self.cells.setdefault(self._cell(self.lon[i], self.lat[i]), array('l')).append(i)
+
+    def _cell(self, lon, lat):
+        W, S, E, N = EXTENT
+        col = min(int((lon - W) / (E - W) * GRID), GRID - 1)
+        row = min(int((lat - S) / (N - S) * GRID), GRID - 1)
+        return col, row
+
+    def query(self, bbox, minDate, maxDate, sort=None):
+        '''
+            ids of photos inside bbox [west, south, east, north] taken within [minDate, maxDate]
+        '''
+        W, S, E, N = bbox
+        if W > EXTENT[2] or E < EXTENT[0] or S > EXTENT[3] or N < EXTENT[1]:
+            return []
+
+        c0, r0 = self._cell(max(W, EXTENT[0]), max(S, EXTENT[1]))
+        c1, r1 = self._cell(min(E, EXTENT[2]), min(N, EXTENT[3]))
+
+        lon, lat, ts = self.lon, self.lat, self.ts
+        ids = []
+        for col in range(c0, c1 + 1):
+            for row in range(r0, r1 + 1):
+                for i in self.cells.get((col, row), ()):
+                    if W <= lon[i] <= E and S <= lat[i] <= N and minDate <= ts[i] <= maxDate:
+                        ids.append(i)
+
+        if sort == "date-taken-asc":
+            ids.sort(key=lambda i: (ts[i], i))
+        elif sort == "date-taken-desc":
+            ids.sort(key=lambda i: (-ts[i], i))
+        else:
+            ids.sort()
+        return ids
+
+    def photo(self, i, staticUrl="https://live.staticflickr.com"):
+        secret = f"{(i * 2654435761) % 2 ** 32:08x}"
+        server = str(i % 10000)
+        owner = f"{i // PHOTOS_PER_OWNER}@N00"
+        return {
+            "id": str(i),
+            "owner": owner,
+            "secret": secret,
+            "server": server,
+            "farm": 66,
+            "title": f"photo {i}",
+            "ispublic": 1,
+            "isfriend": 0,
+            "isfamily": 0,
+            "datetaken": datetime.fromtimestamp(self.ts[i]).strftime("%Y-%m-%d %H:%M:%S"),
+            "datetakengranularity": 0,
+            "datetakenunknown": "0",
+            "tags": "synthetic benchmark",
+            "ownername": f"owner {owner}",
+            "latitude": f"{self.lat[i]:.6f}",
+            "longitude": f"{self.lon[i]:.6f}",
+            "accuracy": "16",
+            "context": 0,
+            "place_id": "",
+            "woeid": "",
+            "url_": f"{staticUrl}/{server}/{i}_{secret}.jpg",
+            "height_": 375,
+            "width_": 500
+        }
+
+
+def _parse_date(value):
+    # accepts unix timestamps and mysql datetimes, like flickr
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class FakeFlickrServer(ThreadingHTTPServer):
+    '''
+        http server answering flickr API calls from a Dataset
+
+        latency    : seconds added to every API call
+        errorRate  : probability that a search or profile call fails with stat == 'fail'
+        imageSize  : bytes served for every static image
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, dataset, latency=0.0, errorRate=0.0, imageSize=64 * 1024, seed=0):
+        super().__init__(address, FakeFlickrHandler)
+        self.dataset = dataset
+        self.latency = latency
+        self.errorRate = errorRate
+        self.image = bytes(random.Random(seed).getrandbits(8) for _ in range(imageSize))
+
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = Counter()
+
+        # consecutive pages of one box reuse the same result list
+        self._results = OrderedDict()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def fail(self):
+        with self.lock:
+            return self.rng.random() < self.errorRate
+
+    def results(self, key):
+        with self.lock:
+            ids = self._results.get(key, None)
+            if ids is not None:
+                self._results.move_to_end(key)
+                return ids
+
+        bbox, minDate, maxDate, sort = key
+        ids = self.dataset.query(bbox, minDate, maxDate, sort)
+
+        with self.lock:
+            self._results[key] = ids
+            while len(self._results) > 64:
+                self._results.popitem(last=False)
+        return ids
+
+
+class FakeFlickrHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, contentType="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data):
+        self._send(200, json.dumps(data).encode())
+
+    def _fail(self, code, message):
+        self._json({"stat": "fail", "code": code, "message": message})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        server = self.server
+
+        if url.path.startswith("/static/"):
+            server.count("static")
+            server.count("bytes", len(server.image))
+            self._send(200, server.image, "image/jpeg")
+            return
+
+        if url.path == "/stats":
+            with server.lock:
+                self._json(dict(server.counters))
+            return
+
+        if url.path != "/services/rest/":
+            self._send(404, b"not found", "text/plain")
+            return
+
+        params = {key: val[-1] for key, val in parse_qs(url.query).items()}
+        method = params.get("method", "")
+        server.count(method)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if method == "flickr.test.echo":
+            self._json({"method": {"_content": method}, "api_key": {"_content": params.get("api_key", "")}, "stat": "ok"})
+        elif method == "flickr.photos.search":
+            if server.fail():
+                self._fail(105, "Service currently unavailable")
+                return
+            self._search(params)
+        elif method == "flickr.profile.getProfile":
+            if server.fail():
+                self._fail(105, "Service currently unavailable")
+                return
+            userId = params.get("user_id", "")
+            self._json({"profile": {"id": userId, "nsid": userId, "hometown": "Kolkata"}, "stat": "ok"})
+        else:
+            self._fail(112, f'Method "{method}" not found')
+
+    def _search(self, params):
+        try:
+            bbox = tuple(float(coord) for coord in params["bbox"].split(","))
+            minDate = _parse_date(params.get("min_taken_date", "0"))
+            maxDate = _parse_date(params.get("max_taken_date", str(2 ** 31)))
+            page = max(int(params.get("page", 1)), 1)
+            perPage = min(int(params.get("per_page", DEFAULT_PER_PAGE)), MAX_PER_PAGE)
+        except (KeyError, ValueError):
+            self._fail(3, "Invalid bbox or dates")
+            return
+
+        ids = self.server.results((bbox, minDate, maxDate, params.get("sort", None)))
+        total = len(ids)
+        pages = math.ceil(total / perPage) if perPage else 0
+
+        # like flickr, results past the 4000th are never served; later pages repeat the last one
+        servable = min(total, MAX_RESULTS)
+        start = min((page - 1) * perPage, max(servable - perPage, 0))
+        dataset = self.server.dataset
+        photos = []
+        staticUrl = f"{self.server.url}/static"
+        photos = [dataset.photo(i, staticUrl) for i in ids[start:min(start + perPage, servable)]]
+
+        self._json({
+            "photos": {"page": page, "pages": pages, "perpage": perPage, "total": total, "photo": photos},
+            "stat": "ok"
+        })
+
+
+def serve(size, density="uniform", seed=0, host="127.0.0.1", port=0, **options):
+    '''
+        generates a dataset and returns a started server; call shutdown() when done
+    '''
+    server = FakeFlickrServer((host, port), Dataset(size, density, seed), seed=seed, **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="run a local fake flickr API")
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--density", choices=DENSITIES, default="uniform")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeFlickrServer(("127.0.0.1", args.port), Dataset(args.size, args.density, args.seed), \
+                              latency=args.latency, errorRate=args.error_rate, seed=args.seed)
+    print(f"serving {args.size} {args.density} photos on {server.url}")
+    server.serve_forever()
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+
+ queues of boxes left to harvest:
+
+    BoxQueue          : in memory; shared by the harvest threads of one process
+    PriorityBoxQueue  : in memory; boxes near the map view or pinned areas first
+    SqliteBoxQueue    : sqlite file; shared by harvest processes on several nodes
+
+ both hand out WorkItems from get() and take them back in done()
+"""
+
+import json
+import math
+import heapq
+import time
+import sqlite3
+import threading
+from itertools import count
+from collections import deque, namedtuple
+from datetime import datetime
+
+from .constants import LEASE_TIME, HEARTBEAT_INTERVAL, QUEUE_POLL_INTERVAL, DENSITY_GRID
+
+# id is the row of the item in a SqliteBoxQueue; None in memory
+WorkItem = namedtuple('WorkItem', ['bbox', 'depth', 'id'])
+
+
+class BoxQueue:
+    '''
+        thread safe FIFO of (box, depth) work items
+
+        a box is in flight between get() and done(); the queue is only finished
+        when nothing is queued or in flight, since an in flight box may still be
+        subdivided into new ones
+    '''
+    def __init__(self):
+        self._items = deque()
+        self._inFlight = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def seed(self, bbox, items=None):
+        '''
+            puts the whole boundary, or the (box, depth) items of a plan of it, on the queue
+
+            Returns:
+                True if this call seeded the queue
+        '''
+        for box, depth in items if items is not None else [(bbox, 0)]:
+            self.put(box, depth)
+        return True
+
+    def put(self, bbox, depth):
+        with self._cond:
+            self._items.append(WorkItem(bbox, depth, None))
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        '''
+            Returns:
+                the next WorkItem; None on timeout or once the queue is finished
+        '''
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or not self._inFlight, timeout):
+                return None
+            if not self._items:
+                return None
+            self._inFlight += 1
+            return self._items.popleft()
+
+    def done(self, item):
+        with self._cond:
+            self._inFlight -= 1
+            self._cond.notify_all()
+
+    def finished(self):
+        with self._cond:
+            return not self._items and not self._inFlight
+
+    def observe(self, bbox, photos):
+        '''
+            number of photos a search found in a box; used by queues that schedule by density
+        '''
+        pass
+
+    def close(self):
+        pass
+
+
+def _distance(bbox, extent):
+    # degrees between two [west, south, east, north] rectangles; 0 when they overlap
+    W, S, E, N = bbox[:4]
+    vW, vS, vE, vN = extent
+    return math.hypot(max(vW - E, W - vE, 0), max(vS - N, S - vN, 0))
+
+
+class PriorityBoxQueue(BoxQueue):
+    '''
+        box queue handing out the most useful box first:
+
+            1. boxes overlapping a pinned area
+            2. boxes closer to the viewport (the map canvas extent)
+            3. boxes of denser areas, estimated from the searches observed so far
+            4. deeper boxes, which are nearer to downloading photos
+            5. older boxes
+
+        the viewport, pins and density estimates change while harvesting; the
+        queued boxes are then reordered. total work is the same as with a FIFO queue
+    '''
+    def __init__(self, viewport=None, pins=()):
+        super().__init__()
+        self._items = []
+        self._order = count()
+        self.viewport = viewport
+        self.pins = list(pins)
+
+        # photos per square degree over the boundary, refined as boxes are searched
+        self._extent = None
+        self._density = None
+        self._area = None
+        # densities changed since the queued boxes were scored
+        self._stale = False
+
+    def _priority(self, bbox, depth, order):
+        pinned = any(_distance(bbox, pin) == 0 for pin in self.pins)
+        distance = _distance(bbox, self.viewport) if self.viewport is not None else 0.0
+        return (not pinned, distance, -self._estimate(bbox), -depth, order)
+
+    def _cell(self, lon, lat):
+        W, S, E, N = self._extent
+        col = min(max(int((lon - W) / ((E - W) or 1) * DENSITY_GRID), 0), DENSITY_GRID - 1)
+        row = min(max(int((lat - S) / ((N - S) or 1) * DENSITY_GRID), 0), DENSITY_GRID - 1)
+        return row * DENSITY_GRID + col
+
+    def _estimate(self, bbox):
+        if self._density is None:
+            return 0.0
+        return self._density[self._cell((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)]
+
+    def seed(self, bbox, items=None):
+        with self._cond:
+            self._extent = bbox[:4]
+            self._density = [0.0] * DENSITY_GRID ** 2
+            self._area = [math.inf] * DENSITY_GRID ** 2
+        return super().seed(bbox, items)
+
+    def put(self, bbox, depth):
+        with self._cond:
+            order = next(self._order)
+            heapq.heappush(self._items, (self._priority(bbox, depth, order), WorkItem(bbox, depth, None)))
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or not self._inFlight, timeout):
+                return None
+            if not self._items:
+                return None
+            if self._stale:
+                # one rescore for every observation since the last get
+                self._reprioritize()
+            self._inFlight += 1
+            return heapq.heappop(self._items)[1]
+
+    def observe(self, bbox, photos):
+        with self._cond:
+            if self._extent is None:
+                return
+            W, S, E, N = bbox[:4]
+            area = max((E - W) * (N - S), 1e-12)
+            c0, c1 = self._cell(W, S), self._cell(E, N)
+            # the smallest box searched over a cell gives its density
+            for row in range(c0 // DENSITY_GRID, c1 // DENSITY_GRID + 1):
+                for col in range(c0 % DENSITY_GRID, c1 % DENSITY_GRID + 1):
+                    cell = row * DENSITY_GRID + col
+                    if area <= self._area[cell]:
+                        self._area[cell] = area
+                        self._stale |= self._density[cell] != photos / area
+                        self._density[cell] = photos / area
+
+    def _reprioritize(self):
+        self._items = [(self._priority(item.bbox, item.depth, key[-1]), item) for key, item in self._items]
+        heapq.heapify(self._items)
+        self._stale = False
+
+    def setViewport(self, extent):
+        '''
+            extent [west, south, east, north] in lon/lat; None for no viewport
+        '''
+        with self._cond:
+            self.viewport = extent
+            self._reprioritize()
+
+    def pin(self, extent):
+        with self._cond:
+            self.pins.append(extent)
+            self._reprioritize()
+
+    def clearPins(self):
+        with self._cond:
+            self.pins = []
+            self._reprioritize()
+
+
+def _encode_box(bbox):
+    W, S, E, N, startDate, endDate = bbox
+    return W, S, E, N, startDate.timestamp(), endDate.timestamp()
+
+
+def _decode_box(row):
+    W, S, E, N, startDate, endDate = row
+    return [W, S, E, N, datetime.fromtimestamp(startDate), datetime.fromtimestamp(endDate)]
+
+
+class SqliteBoxQueue:
+    '''
+        durable box queue in a sqlite file, for one harvest split over several nodes
+
+        - get() leases a box to this node for LEASE_TIME seconds; a heartbeat thread
+          renews the leases of boxes still being worked on, so boxes of a node that
+          died are handed out again once their lease expires
+        - subdivisions are put back into the file and may be claimed by any node
+        - nodes register themselves; finish() reports whether no node is still
+          running. a node whose heartbeat is older than the lease is taken for dead
+
+        the file may live on shared storage; it uses the default rollback journal
+        since WAL does not work over network file systems
+    '''
+    def __init__(self, path, node, lease=LEASE_TIME, heartbeat=HEARTBEAT_INTERVAL):
+        self.path = path
+        self.node = node
+        self.lease = lease
+        self.heartbeat = heartbeat
+
+        self._local = threading.local()
+        # every thread's connection, so close() can release the file for good
+        self._connections = []
+        self._connectionsLock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+        with self._transaction() as con:
+            con.execute('''CREATE TABLE IF NOT EXISTS boxes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                west REAL, south REAL, east REAL, north REAL, start REAL, end REAL,
+                depth INTEGER,
+                state TEXT DEFAULT 'queued',
+                owner TEXT,
+                lease_until REAL
+            )''')
+            con.execute('CREATE INDEX IF NOT EXISTS boxes_state ON boxes (state)')
+            con.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            con.execute('CREATE TABLE IF NOT EXISTS nodes (node TEXT PRIMARY KEY, state TEXT, heartbeat REAL)')
+            con.execute("INSERT OR REPLACE INTO nodes VALUES (?, 'running', ?)", (node, time.time()))
+            # a node restarted under the same name takes its boxes back up right away
+            con.execute("UPDATE boxes SET state = 'queued', owner = NULL WHERE state = 'leased' AND owner = ?", (node,))
+
+    def _connection(self):
+        # one connection per thread; close() closes them all once the threads are done
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            with self._connectionsLock:
+                self._connections.append(con)
+        return con
+
+    class _Transaction:
+        def __init__(self, con):
+            self.con = con
+
+        def __enter__(self):
+            # take the write lock up front so two nodes never lease the same box
+            self.con.execute('BEGIN IMMEDIATE')
+            return self.con
+
+        def __exit__(self, excType, exc, tb):
+            self.con.execute('ROLLBACK' if excType else 'COMMIT')
+
+    def _transaction(self):
+        return self._Transaction(self._connection())
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM boxes WHERE state = 'queued'").fetchone()[0]
+
+    def seed(self, bbox, items=None):
+        '''
+            puts the whole boundary, or the (box, depth) items of a plan of it, on
+            the queue unless another node already did
+
+            Returns:
+                True if this call seeded the queue
+
+            Raises:
+                ValueError if the queue was seeded with another boundary
+        '''
+        boundary = json.dumps(_encode_box(bbox))
+        with self._transaction() as con:
+            row = con.execute("SELECT value FROM meta WHERE key = 'boundary'").fetchone()
+            if row is not None:
+                if row[0] != boundary:
+                    raise ValueError(f"{self.path} belongs to the harvest of another boundary")
+                return False
+            con.execute("INSERT INTO meta VALUES ('boundary', ?)", (boundary,))
+            con.executemany('INSERT INTO boxes (west, south, east, north, start, end, depth) VALUES (?, ?, ?, ?, ?, ?, ?)', \
+                            [_encode_box(box) + (depth,) for box, depth in (items if items is not None else [(bbox, 0)])])
+        return True
+
+    def put(self, bbox, depth):
+        with self._transaction() as con:
+            con.execute('INSERT INTO boxes (west, south, east, north, start, end, depth) VALUES (?, ?, ?, ?, ?, ?, ?)', \
+                        _encode_box(bbox) + (depth,))
+
+    def _claim(self):
+        now = time.time()
+        with self._transaction() as con:
+            # boxes of nodes that stopped renewing their leases go back to the queue
+            con.execute("UPDATE boxes SET state = 'queued', owner = NULL WHERE state = 'leased' AND lease_until < ?", (now,))
+            row = con.execute("SELECT id, west, south, east, north, start, end, depth FROM boxes "
+                              "WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            con.execute("UPDATE boxes SET state = 'leased', owner = ?, lease_until = ? WHERE id = ?", \
+                        (self.node, now + self.lease, row[0]))
+        return WorkItem(_decode_box(row[1:7]), row[7], row[0])
+
+    def get(self, timeout=None):
+        '''
+            Returns:
+                the next WorkItem leased to this node; None on timeout or once the queue is finished
+        '''
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+            self._heartbeat.start()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            item = self._claim()
+            if item is not None or self.finished():
+                return item
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(QUEUE_POLL_INTERVAL)
+
+    def done(self, item):
+        with self._transaction() as con:
+            con.execute("UPDATE boxes SET state = 'done', owner = NULL WHERE id = ? AND owner = ?", (item.id, self.node))
+
+    def finished(self):
+        row = self._connection().execute("SELECT COUNT(*) FROM boxes WHERE state != 'done'").fetchone()
+        return row[0] == 0
+
+    def observe(self, bbox, photos):
+        pass
+
+    def _beat(self):
+        while not self._stop.wait(self.heartbeat):
+            now = time.time()
+            try:
+                with self._transaction() as con:
+                    con.execute("UPDATE boxes SET lease_until = ? WHERE state = 'leased' AND owner = ?", \
+                                (now + self.lease, self.node))
+                    con.execute("UPDATE nodes SET heartbeat = ? WHERE node = ?", (now, self.node))
+            except sqlite3.Error:
+                # shared storage hiccup; the next beat tries again before the lease runs out
+                pass
+
+    def finish(self, state='done'):
+        '''
+            marks this node done, or failed when it stopped before writing its share
+
+            Returns:
+                True if no registered node is still running
+        '''
+        now = time.time()
+        with self._transaction() as con:
+            con.execute("UPDATE nodes SET state = ?, heartbeat = ? WHERE node = ?", (state, now, self.node))
+            # nodes that died without a word stopped beating
+            con.execute("UPDATE nodes SET state = 'failed' WHERE state = 'running' AND heartbeat < ?", (now - self.lease,))
+            running = con.execute("SELECT COUNT(*) FROM nodes WHERE state = 'running'").fetchone()[0]
+        return running == 0
+
+    def close(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        with self._connectionsLock:
+            connections, self._connections = self._connections, []
+        for con in connections:
+            con.close()
+        self._local = threading.local()
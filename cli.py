@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+
+ command line entry point for headless harvests; run from the plugins folder:
+
+    python -m flickr.cli --key KEY [KEY ...] --west 88.2 --south 22.4 --east 88.5 --north 22.7 \\
+        --start 2020-01-01 --end 2021-01-01 --csv photos.csv
+
+ one harvest may be split over several nodes sharing a queue file; run the same
+ command with --queue /shared/harvest.sqlite on every node, then if needed
+
+    python -m flickr.cli merge --csv photos.csv
+"""
+
+import os
+import sys
+import argparse
+import logging
+from datetime import datetime
+
+from .harvester import Harvester, merge_partitions
+from .planner import Planner, save_plan, load_plan, format_plan
+from .aoi import load_geojson, clip_boundary
+from .boxqueue import PriorityBoxQueue
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a date of the form YYYY-MM-DD")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="flickr.cli",
+        description="harvest geotagged flickr photos within a boundary into a csv file"
+    )
+    parser.add_argument("--key", required=True, nargs="+", help="flickr API keys; boxes are shared out over all of them")
+    parser.add_argument("--west", type=float, required=True, help="western longitude")
+    parser.add_argument("--south", type=float, required=True, help="southern latitude")
+    parser.add_argument("--east", type=float, required=True, help="eastern longitude")
+    parser.add_argument("--north", type=float, required=True, help="northern latitude")
+    parser.add_argument("--start", type=_date, required=True, help="start date taken (YYYY-MM-DD)")
+    parser.add_argument("--end", type=_date, required=True, help="end date taken (YYYY-MM-DD)")
+    parser.add_argument("--csv", help="output csv file; required unless --dry-run")
+    parser.add_argument("--output-dir", default="", help="folder for downloaded images")
+    parser.add_argument("--save-images", action="store_true", help="download images into --output-dir")
+    parser.add_argument("--metrics", help="write per stage timings and counters of the run to this json file")
+    parser.add_argument("--queue", help="sqlite file holding the box queue shared with harvests on other nodes")
+    parser.add_argument("--node", help="name of this node in the shared queue; defaults to host-pid")
+    parser.add_argument("--aoi", help="GeoJSON file of polygons in lon/lat; boxes and photos outside them are skipped")
+    parser.add_argument("--focus", type=float, nargs=4, metavar=("WEST", "SOUTH", "EAST", "NORTH"), action="append",
+                        help="harvest boxes overlapping this area first; may be repeated")
+    parser.add_argument("--cursor", action="store_true", help="walk boxes by date taken instead of page numbers")
+    parser.add_argument("--dry-run", action="store_true", help="only estimate the API calls and time the harvest needs")
+    parser.add_argument("--plan", help="json plan file; written by --dry-run, followed by a harvest")
+    parser.add_argument("--no-cache", action="store_true", help="neither read nor write the search cache")
+    parser.add_argument("--quiet", action="store_true", help="only print errors")
+    parser.add_argument("--verbose", action="store_true", help="also print per request logs and cache logs")
+    return parser
+
+
+def merge(argv):
+    parser = argparse.ArgumentParser(
+        prog="flickr.cli merge",
+        description="merge the partitions written by the nodes of a shared harvest"
+    )
+    parser.add_argument("--csv", required=True, help="csv file given to the harvest")
+    args = parser.parse_args(argv)
+
+    try:
+        count = merge_partitions(args.csv)
+    except (OSError, ValueError) as ex:
+        print(f"Error: {ex}", file=sys.stderr)
+        return 1
+
+    print(f"merged {count} photos into {args.csv}")
+    return 0
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["merge"]:
+        return merge(argv[1:])
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    for name in ("north", "south"):
+        if not (-90 <= getattr(args, name) <= 90):
+            parser.error("latitude must lie between -90 and 90 degrees")
+    for name in ("east", "west"):
+        if not (-180 <= getattr(args, name) <= 180):
+            parser.error("longitude must lie between -180 and 180 degrees")
+    if args.start > args.end:
+        parser.error("start date and end date not compatible")
+    if args.save_images and len(args.output_dir) == 0:
+        parser.error("--save-images requires --output-dir")
+    if not args.dry_run and not args.csv:
+        parser.error("--csv is required")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    # swap coordinates if required
+    north, south = max(args.north, args.south), min(args.north, args.south)
+    east, west = max(args.east, args.west), min(args.east, args.west)
+    boundary = [west, south, east, north, args.start, args.end]
+
+    area = None
+    if args.aoi:
+        try:
+            area = load_geojson(args.aoi)
+        except (OSError, ValueError, KeyError) as ex:
+            parser.error(f"could not read area of interest: {ex}")
+        if clip_boundary(boundary, area) is None:
+            parser.error("the area of interest lies outside the boundary")
+
+    if args.save_images and not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+
+    def on_message(message, messageLevel=logging.INFO):
+        if messageLevel >= level:
+            print(message)
+
+    def on_error(message):
+        print(message, file=sys.stderr)
+
+    if args.dry_run:
+        planner = Planner(boundary, args.key, onMessage=None if args.quiet else on_message, onError=on_error, area=area)
+        try:
+            plan = planner.run()
+        except KeyboardInterrupt:
+            planner.stop()
+            on_error("planning interrupted")
+            return 130
+        if plan is None:
+            return 1
+
+        print(format_plan(plan))
+        if args.plan:
+            save_plan(plan, args.plan)
+        return 0
+
+    plan = None
+    if args.plan:
+        try:
+            plan = load_plan(args.plan)
+        except (OSError, ValueError, KeyError) as ex:
+            parser.error(f"could not read plan: {ex}")
+
+    harvester = Harvester(
+        boundary, args.key, args.csv, args.output_dir, args.save_images,
+        onMessage=None if args.quiet else on_message,
+        onError=on_error,
+        useCache=not args.no_cache,
+        queueFile=args.queue,
+        node=args.node,
+        plan=plan,
+        cursor=args.cursor,
+        area=area,
+        boxQueue=PriorityBoxQueue(pins=args.focus) if args.focus else None
+    )
+
+    try:
+        df = harvester.run()
+    except KeyboardInterrupt:
+        harvester.stop()
+        on_error("harvest interrupted")
+        return 130
+    finally:
+        if args.metrics:
+            harvester.metrics.to_json(args.metrics)
+
+    return 0 if len(df) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
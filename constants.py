@@ -57,3 +57,67 @@ BOX_DIVISION_THRESHOLD = 1e-4
 CHUNK_SIZE = 4096
 
 PROFILE_LOAD_TIME = 5
+
+# popup web views are pooled and reused; at most POPUP_POOL_SIZE views exist at once
+POPUP_POOL_SIZE = 8
+# selections larger than this are shown in the gallery instead of popups
+GALLERY_THRESHOLD = 1
+# size limit of the on-disk http cache shared by all popup views
+POPUP_CACHE_SIZE = 256 * 1024 * 1024
+
+# gallery thumbnails use the 150px square flickr size
+THUMBNAIL_SUFFIX = '_q'
+THUMBNAIL_SIZE = IMAGE_SIZE_SUFFIX_MAP[THUMBNAIL_SUFFIX]
+# feature attributes are read from the layer this many rows at a time
+GALLERY_BLOCK_SIZE = 100
+# rows of attributes and thumbnails kept in memory by the gallery
+GALLERY_CACHE_SIZE = 1000
+
+# latency histograms keep a uniform sample of this many observations for percentiles
+HISTOGRAM_RESERVOIR = 10000
+
+# milliseconds between flushes of buffered worker output into the gui
+FLUSH_INTERVAL = 100
+
+# lines kept by the log view
+LOG_RING_SIZE = 5000
+# the log file rolls over at LOG_FILE_SIZE bytes keeping LOG_FILE_COUNT old files
+LOG_FILE_SIZE = 5 * 1024 * 1024
+LOG_FILE_COUNT = 3
+
+# flickr allows 3600 queries an hour per API key; requests are spread over the hour
+# with bursts of at most KEY_BURST
+KEY_RATE_LIMIT = 3600
+KEY_BURST = 10
+# a key failing this many searches in a row is retired for KEY_RETIRE_TIME seconds,
+# doubling on every further retirement up to KEY_MAX_RETIRE_TIME
+KEY_MAX_FAILURES = 5
+KEY_RETIRE_TIME = 60
+KEY_MAX_RETIRE_TIME = 60 * 60
+# flickr error code for an invalid key; http status for a key over its rate limit
+KEY_INVALID_CODE = 100
+KEY_RATE_LIMITED_CODE = 429
+# harvest threads started per API key
+THREADS_PER_KEY = 1
+# seconds an idle harvest thread waits for a box before checking if it should stop
+QUEUE_POLL_INTERVAL = 0.5
+
+# seconds a cached search result stays fresh; older ones are fetched again and deleted
+SEARCH_CACHE_LIFE = 24 * 60 * 60
+
+# seconds a box leased from a shared queue file stays with a node without a heartbeat
+LEASE_TIME = 120
+# seconds between heartbeats renewing the leases of a node
+HEARTBEAT_INTERVAL = 30
+
+# average size in bytes of an image at IMAGE_SIZE, used to estimate downloads when planning
+AVERAGE_IMAGE_BYTES = 80 * 1024
+
+# format of date taken in search results
+DATE_TAKEN_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# horizontal bands the edges of an area of interest are indexed in
+AOI_BANDS = 256
+
+# cells per side of the grid a priority box queue estimates photo density on
+DENSITY_GRID = 64
@@ -27,8 +27,6 @@ from qgis.PyQt.QtWidgets import QAction
 
 # Initialize Qt resources from file resources.py
 from .resources import *
-# Import the code for the dialog
-from .flickr_dialog import FlickrDialog
 import os.path
 
 
@@ -65,7 +63,7 @@ class Flickr:
 
         # Create the dialog with elements (after translation) and keep reference
         # Only create GUI ONCE in callback, so that it will only load when the plugin is started
-        self.dlg = FlickrDialog()
+        self.dlg = None
 
 
     # noinspection PyMethodMayBeStatic
@@ -179,6 +177,12 @@ class Flickr:
     def run(self):
         """Run method that performs all the real work"""
 
+        # import and build the dialog on first use; keeps QGIS startup free of
+        # pandas, requests and QtWebKit
+        if self.dlg is None:
+            from .flickr_dialog import FlickrDialog
+            self.dlg = FlickrDialog()
+
         # show the dialog
         self.dlg.show()
         # Run the dialog event loop
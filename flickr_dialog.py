@@ -7,52 +7,33 @@
 """
 
 import os
-import requests
 from datetime import datetime
-from collections import deque
-import pandas as pd
-import socket
-import sys
+import logging
+import threading
 
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'mongocache'))
-
-from mongocache import mongocache
-
-from qgis.PyQt import uic
 from qgis.PyQt import QtWidgets
 from qgis.PyQt.QtWidgets import QFileDialog, QMessageBox
-from qgis.PyQt.QtCore import QObject, QThread, pyqtSignal, QDate, QVariant, QUrl
+from qgis.PyQt.QtCore import QObject, QThread, QTimer, pyqtSignal, QDate, QVariant, QUrl
 
-from qgis.core import QgsVectorLayer, QgsFeature, QgsGeometry, QgsPointXY, QgsProject, QgsField, QgsPoint, QgsRectangle, QgsMessageLog
-from PyQt5.QtWebKitWidgets import QWebView
+from qgis.core import QgsVectorLayer, QgsFeature, QgsGeometry, QgsPointXY, QgsProject, QgsField, QgsPoint, QgsRectangle, QgsMessageLog, \
+    QgsWkbTypes, QgsCoordinateTransform, QgsCoordinateReferenceSystem, QgsFeatureRequest
 from qgis.utils import iface
 
-from .constants import IMAGE_SIZE_SUFFIX, IMAGE_URL_TYPE, LOCATION_ACCURACY, RES_PER_PAGE, \
-    MAX_RES_PER_QUERY, MAX_SAME_QUERIES, BOX_DIVISION_THRESHOLD, CHUNK_SIZE, PROFILE_LOAD_TIME
+from .constants import IMAGE_URL_TYPE, PROFILE_LOAD_TIME, GALLERY_THRESHOLD, FLUSH_INTERVAL
+from .metrics import format_snapshot
+from .logview import LogView
+from .aoi import clip_boundary
+from .boxqueue import PriorityBoxQueue
+# precompiled from flickr_dialog_base.ui with pyuic5; saves parsing the .ui file at runtime
+from .flickr_dialog_base_ui import Ui_FlickrDialogBase as FORM_CLASS
+
+# harvester (pandas, requests, pymongo), popups (QtWebKit) and gallery are imported
+# on first use so opening the dialog does not pay for them
 
 localdir = os.path.join(os.getenv('APPDATA'), 'qgis-flickr')
 if not os.path.exists(localdir):
     os.makedirs(localdir)
 
-# This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer
-FORM_CLASS, _ = uic.loadUiType(os.path.join(
-    os.path.dirname(__file__), 'flickr_dialog_base.ui'))
-
-
-
-html_template_file = open(os.path.join(os.path.dirname(__file__), 'template.html'))
-html_template = html_template_file.read()
-html_template_file.close()
-
-def is_connected():
-    try:
-        # connect to the host google.com -- tells us if the host is actually reachable
-        socket.create_connection(("1.1.1.1", 53))
-        return True
-    except OSError:
-        pass
-    return False
-
 
 class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
     def __init__(self, parent=None):
@@ -71,14 +52,16 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
         self.outputDirPicker.clicked.connect(self._select_output_folder)
         self.startButton.clicked.connect(self._start_download_thread)
         self.stopButton.clicked.connect(self._stop_download_thread)
+        self.pinViewButton.clicked.connect(self._pin_view)
         self.removeVectorLayer.clicked.connect(self._remove_layers)
         self.closeImages.clicked.connect(self._close_browser_windows)
 
         # set download in progress flag as false
         self.isDownloadInProgress = False
 
-        # set logbox empty
-        self.logBox.setPlainText("")
+        # bounded log view over the logbox with level filtering
+        self.log = LogView(self.logBox, self.logLevel)
+        self.statsLabel.setText("")
 
         # set progress bar to zero
         self.progressBar.setValue(0)
@@ -87,6 +70,15 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
         # disable stop button
         self.stopButton.setEnabled(False)
 
+        # worker output is buffered and flushed into the gui at a fixed rate
+        self.flushTimer = QTimer(self)
+        self.flushTimer.setInterval(FLUSH_INTERVAL)
+        self.flushTimer.timeout.connect(self._flush_worker)
+
+        # photo popups and gallery are created on the first feature selection
+        self._popups = None
+        self._gallery = None
+
         self.elem_config_map = {
             "API_KEY": self.apiKey,
             "DB_FILE_NAME": self.dbFileName,
@@ -100,7 +92,8 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
             "START_DATE": self.startDate,
             "END_DATE": self.endDate,
             "SAVE_LOG": self.saveLogCheck,
-            "SAVE_IMAGES": self.saveImages
+            "SAVE_IMAGES": self.saveImages,
+            "USE_CACHE": self.useCacheCheck
         }
 
         self.configFilePath = os.path.join(localdir, ".conf")
@@ -115,19 +108,41 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
         # connect to layer cleanup
         self.rejected.connect(self._cleanup)
 
+        # stream log lines to a rotating log file while save log is checked
+        self.saveLogCheck.toggled.connect(self._toggle_log_file)
+        self._toggle_log_file(self.saveLogCheck.isChecked())
+
         # connect to save log
         self.rejected.connect(self._save_log)
 
-    def _save_log(self):
-        if self.saveLogCheck.isChecked():
+    def _toggle_log_file(self, checked):
+        if checked:
             try:
-                f = open(self.logFilePath, 'w')
-            except:
-                return
+                self.log.openFile(self.logFilePath)
+            except Exception as ex:
+                self.log.append(f"Error: could not open log file: {ex}", logging.ERROR)
+        else:
+            self.log.closeFile()
 
-            f.write(self.logBox.toPlainText())
-            f.close()
-        return
+    def _save_log(self):
+        # flush pending lines to disk; reopened lazily when the dialog is shown again
+        self.log.closeFile()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._toggle_log_file(self.saveLogCheck.isChecked())
+        self._load_aoi_layers()
+
+    def _load_aoi_layers(self):
+        # polygon layers of the project may serve as area of interest
+        current = self.aoiLayer.currentData()
+        self.aoiLayer.clear()
+        self.aoiLayer.addItem("Boundary only", None)
+        for layer in QgsProject.instance().mapLayers().values():
+            if isinstance(layer, QgsVectorLayer) and layer.geometryType() == QgsWkbTypes.PolygonGeometry:
+                self.aoiLayer.addItem(layer.name(), layer.id())
+        index = self.aoiLayer.findData(current)
+        self.aoiLayer.setCurrentIndex(max(index, 0))
 
     def _remove_layers(self):
         try:
@@ -136,13 +151,27 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
         except:
             pass
 
+    @property
+    def popups(self):
+        # pool of reusable photo popups sharing one on-disk http cache
+        if self._popups is None:
+            from .popups import PopupManager
+            self._popups = PopupManager(cacheDir=os.path.join(localdir, 'netcache'))
+        return self._popups
+
+    @property
+    def gallery(self):
+        # one gallery window for multi-feature selections
+        if self._gallery is None:
+            from .gallery import GalleryWidget
+            self._gallery = GalleryWidget(self.popups.networkManager, self.popups)
+        return self._gallery
+
     def _close_browser_windows(self):
-        if hasattr(self, 'webViews'):
-            for webView in self.webViews:
-                try:
-                    webView.close()
-                except:
-                    pass
+        if self._popups is not None:
+            self._popups.close_all()
+        if self._gallery is not None:
+            self._gallery.close()
 
     def _cleanup(self):
         # clean vector layer
@@ -162,7 +191,7 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
         for key, val in self.elem_config_map.items():
             if key == "START_DATE" or key == "END_DATE":
                 l.append(f"{key}={val.date().toPyDate().strftime('%Y-%m-%d')}")
-            elif key == 'SAVE_LOG' or key == 'SAVE_IMAGES':
+            elif key in ('SAVE_LOG', 'SAVE_IMAGES', 'USE_CACHE'):
                 l.append(f"{key}={'true' if val.isChecked() else 'false'}")
             else:
                 l.append(f"{key}={val.text()}")
@@ -177,7 +206,7 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
             try:
                 f = open(self.configFilePath)
             except:
-                self.logBox.append("Error: could not load from config file.")
+                self.log.append("Error: could not load from config file.", logging.ERROR)
                 return
 
             for line in f.readlines():
@@ -189,7 +218,7 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
                     y, m, d = int(y), int(m), int(d)
                     d = QDate(y, m, d)
                     elem.setDate(d)
-                elif key == 'SAVE_LOG' or key == 'SAVE_IMAGES':
+                elif key in ('SAVE_LOG', 'SAVE_IMAGES', 'USE_CACHE'):
                     elem.setChecked(val == "true")
                 else:    
                     elem.setText(val)
@@ -240,7 +269,8 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
 
         if not self.isDownloadInProgress:
             # collect data
-            apiKey = self.apiKey.text()
+            # several keys may be given separated by commas
+            apiKey = [key.strip() for key in self.apiKey.text().split(',') if key.strip()]
             north = self.north.text()
             south = self.south.text()
             east = self.east.text()
@@ -322,31 +352,51 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
                 startDate <= endDate \
                 and len(dbFileName) != 0 and len(tableName) != 0 and len(csvFileName) != 0 and len(outputDirName) != 0:
 
+                startDate = datetime.combine(startDate.toPyDate(), datetime.min.time())
+                endDate = datetime.combine(endDate.toPyDate(), datetime.min.time())
+                boundary = [westLong, southLat, eastLong, northLat, startDate, endDate]
+
+                # polygon layer as area of interest
+                area = None
+                layerId = self.aoiLayer.currentData()
+                if layerId is not None:
+                    layer = QgsProject.instance().mapLayer(layerId)
+                    try:
+                        area = LayerArea(layer)
+                    except (AttributeError, ValueError) as ex:
+                        QMessageBox.warning(self, "Error", f"could not read area of interest: {ex}")
+                        return
+                    if clip_boundary(boundary, area) is None:
+                        QMessageBox.warning(self, "Error", "the area of interest lies outside the boundary")
+                        return
+
                 # no error in input; set download in progress
                 self.isDownloadInProgress = True
                 self.startButton.setEnabled(False)
                 self.stopButton.setEnabled(True)
+                self.pinViewButton.setEnabled(True)
 
                 # clear log
-                self.logBox.clear()
+                self.log.clear()
 
-                # modify date to datetime object
-                startDate = datetime.combine(startDate.toPyDate(), datetime.min.time())
-                endDate = datetime.combine(endDate.toPyDate(), datetime.min.time())
-                boundary = [westLong, southLat, eastLong, northLat, startDate, endDate]
+                # boxes nearest the map view are harvested first; follows the canvas while running
+                self.boxQueue = PriorityBoxQueue(viewport=self._canvas_extent())
+                iface.mapCanvas().extentsChanged.connect(self._viewport_changed)
 
                 # create thread handler
                 self.thread = QThread()
 
                 # create worker
-                self.worker = Worker(boundary, apiKey, dbFileName, tableName, csvFileName, outputDirName, self.saveImages.isChecked())
+                self.worker = Worker(boundary, apiKey, dbFileName, tableName, csvFileName, outputDirName, self.saveImages.isChecked(), \
+                                     area, self.boxQueue, self.useCacheCheck.isChecked())
                 self.worker.moveToThread(self.thread)
 
                 # connect signals to slots
-                self.worker.addMessage.connect(self._message_from_worker)
+                self.worker.addMessages.connect(self._messages_from_worker)
                 self.worker.addError.connect(self._error_from_worker)
                 self.worker.progress.connect(self._progress_from_worker)
                 self.worker.total.connect(self._total_from_worker)
+                self.worker.metrics.connect(self._metrics_from_worker)
 
                 self.thread.started.connect(self.worker.run)
                 self.worker.finished.connect(self.thread.quit)
@@ -355,18 +405,35 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
 
                 # start thread
                 self.thread.start()
+                self.flushTimer.start()
+
+                harvester = self.worker.harvester
 
                 # enable button after thread finishes; set download not in progress
                 def worker_finished(df): 
-                    self.logBox.append("worker finished")
+                    self.flushTimer.stop()
+                    iface.mapCanvas().extentsChanged.disconnect(self._viewport_changed)
+                    self.pinViewButton.setEnabled(False)
+                    self.log.append("worker finished")
                     self.startButton.setEnabled(True)    
                     self.stopButton.setEnabled(False)
                     self.isDownloadInProgress = False
                     self.progressBar.setValue(self.progressBar.maximum())  
 
-                    if type(df) == pd.DataFrame and len(df) > 0:
+                    if df is not None and len(df) > 0:
                         self.df = df
-                        self._draw_layers(west, south, east, north)
+                        with harvester.metrics.timer('draw_layers'):
+                            self._draw_layers(west, south, east, north)
+
+                    # export run metrics next to the csv file
+                    metricsFileName = os.path.splitext(csvFileName)[0] + ".metrics.json"
+                    try:
+                        harvester.metrics.to_json(metricsFileName)
+                    except Exception as ex:
+                        self.log.append(f"could not save metrics: {ex}", logging.WARNING)
+                    else:
+                        self.log.append(f"metrics saved to {metricsFileName}")
+                    self._metrics_from_worker(harvester.metrics.snapshot())
                     
                 self.worker.finished.connect(worker_finished)
             else:
@@ -374,10 +441,10 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
         else:
             pass
 
-    def _add_marker(self, long, lat, title, tags, datetaken, link, ownername):
+    def _add_marker(self, long, lat, title, tags, datetaken, link, ownername, filepath):
         fet = QgsFeature()
         fet.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(long, lat)))
-        fet.setAttributes([title, tags, datetaken, link, ownername])
+        fet.setAttributes([title, tags, datetaken, link, ownername, filepath])
         self.markerProvider.addFeatures([fet])
 
     def _draw_line(self, lat1, lat2, long1, long2):
@@ -392,7 +459,7 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
     def _draw_layers(self, west, south, east, north):
         west, south, east, north  = float(west), float(south), float(east), float(north)
 
-        self.logBox.append('drawing vector layers...')
+        self.log.append('drawing vector layers...')
         # create marker layer
         self.markerLayer = QgsVectorLayer("Point?crs=epsg:4326", "flickr marker", "memory")
         self.markerProvider = self.markerLayer.dataProvider()
@@ -409,7 +476,8 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
             QgsField("tags",  QVariant.String), 
             QgsField("datetaken", QVariant.String), 
             QgsField("link", QVariant.String),
-            QgsField("name", QVariant.String)
+            QgsField("name", QVariant.String),
+            QgsField("filepath", QVariant.String)
         ])
 
         # add bounding box
@@ -419,7 +487,7 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
         self._draw_line(north, south, west, west)
 
         # create feature for each of the points
-        self.logBox.append(f"adding {len(self.df)} features...")
+        self.log.append(f"adding {len(self.df)} features...")
         for _, row in self.df.iterrows():
             self._add_marker(
                 float(row['longitude']),
@@ -428,10 +496,11 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
                 row['tags'], 
                 row['datetaken'], 
                 row[IMAGE_URL_TYPE],
-                row['ownername']
+                row['ownername'],
+                row['filepath']
             )
 
-        self.logBox.append(f"added {len(self.df)} {'features' if len(self.df) > 1 else 'feature'}")
+        self.log.append(f"added {len(self.df)} {'features' if len(self.df) > 1 else 'feature'}")
         
         self.markerLayer.commitChanges()
         self.boundaryLayer.commitChanges()
@@ -440,43 +509,56 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
         QgsProject.instance().addMapLayer(self.markerLayer)
 
         self.markerLayer.selectionChanged.connect(self._handle_feature_selection)
-        self.webViews = []
 
-    def _open_web_view(self, title, tags, datetaken, link, ownername):
-        webView = QWebView()
-        self.webViews.append(webView)
-
-        self.logBox.append(f"loading {title} ...")
+    def _handle_feature_selection(self, selFeatures):
+        # only ids are read here; the gallery loads attributes and thumbnails lazily
+        fids = self.markerLayer.selectedFeatureIds()
+        if len(fids) > GALLERY_THRESHOLD:
+            self.log.append(f"loading {len(fids)} photos ...")
+            self.gallery.setFeatures(self.markerLayer, fids)
+        elif len(fids) > 0:
+            layerId = self.markerLayer.id()
+            for fid in fids:
+                feature = self.markerLayer.getFeature(fid)
+                self.log.append(f"loading {feature['title']} ...")
+                # draw popup on a pooled web view
+                self.popups.show_feature((layerId, fid), feature.attributes())
+
+    def _canvas_extent(self):
+        # map canvas extent in lon/lat
+        canvas = iface.mapCanvas()
+        transform = QgsCoordinateTransform(canvas.mapSettings().destinationCrs(), \
+                                           QgsCoordinateReferenceSystem('EPSG:4326'), QgsProject.instance())
+        try:
+            rect = transform.transformBoundingBox(canvas.extent())
+        except Exception:
+            return None
+        return [rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum()]
 
-        # process args
-        if len(title) == 0:
-            title = "no title"
-        if len(tags.strip(" ")) != 0:
-            tags = str(['"' + tag + '"' for tag in tags.strip().split(" ")])
-        else:
-            tags = []
-        d = datetime.strptime(datetaken, "%Y-%m-%d %H:%M:%S").strftime('%A, %d %B, %Y')
+    def _viewport_changed(self):
+        self.boxQueue.setViewport(self._canvas_extent())
 
-        # generate html
-        webView.setHtml(html_template.format(title, link, title, d, ownername, tags))
-        webView.show()
-        
-    def _handle_feature_selection(self, selFeatures):
-        selFeatures = self.markerLayer.selectedFeatures()
-        if len(selFeatures) > 0:
-            for feature in selFeatures:
-                attrs = feature.attributes()
-                title, tags, datetaken, link, ownername = attrs
-                # draw popup on web view or use native qt dialog
-                self._open_web_view(title, tags, datetaken, link, ownername)
+    def _pin_view(self):
+        extent = self._canvas_extent()
+        if extent is not None:
+            self.boxQueue.pin(extent)
+            self.log.append("current view pinned; its boxes are harvested first")
 
     def _stop_download_thread(self):
         self.worker.stop()
 
-    def _message_from_worker(self, message):
-        self.logBox.append(message)
+    def _flush_worker(self):
+        try:
+            self.worker.flush()
+        except RuntimeError:
+            # worker already deleted
+            self.flushTimer.stop()
+
+    def _messages_from_worker(self, records):
+        self.log.extend(records)
 
     def _error_from_worker(self, message):
+        self.log.append(message, logging.ERROR)
         QMessageBox.warning(self, "Error", message)
 
     def _progress_from_worker(self, progress):
@@ -484,219 +566,145 @@ class FlickrDialog(QtWidgets.QDialog, FORM_CLASS):
 
     def _total_from_worker(self, total):
         self.total_count = total
-        
-
-
-class Worker( QObject ):
-    finished = pyqtSignal(pd.DataFrame)
-    progress = pyqtSignal(int)
-    addMessage = pyqtSignal(str)
-    addError = pyqtSignal(str)
-    total = pyqtSignal(int)
-
-    UNIQUE_KEY = IMAGE_URL_TYPE
-
-    CONNECT_TIMEOUT = 10
-    READ_TIMEOUT = 60
-
-    def __init__(self, boundary, apiKey, dbFileName, tableName, csvFileName, outputDirName, saveImages):
-        QObject.__init__(self)
-        self.boundary = boundary
-        self.apiKey = apiKey
-        self.dbFileName = dbFileName
-        self.csvFileName = csvFileName
-        self.tableName = tableName
-        self.outputDirName = outputDirName
-        self.saveImages = saveImages
-
-        self.running = None
-        self.downloadCount = 0
 
-        self.csvData = []
-        self.df = None
-        self.csvKeys = ["id", "owner", "place_id", "latitude", "longitude", "datetaken", "accuracy", "title", "tags", "ownername", IMAGE_URL_TYPE, "filepath"]
-
-    def stop(self):
-        self.running = False
-
-    def _check_api_key(self):
-        self.addMessage.emit("checking connection to flickr API...")
-        url = f"https://api.flickr.com/services/rest/?api_key={self.apiKey}&method=flickr.test.echo&format=json&nojsoncallback=1"
-        r = requests.get(url)
-
-        if r.status_code == 200:
-            data = r.json()
-            if data['stat'] == 'ok':
-                self.addMessage.emit("Connection OK")
-                return True
-            elif data['stat'] == 'fail':
-                self.addMessage.emit(f"Error: {data['message']}")
-                return False
-        else:
-            if is_connected():
-                self.addError.emit(f"Error: {r.text}")
-            else:
-                self.addError.emit(f"Check Internet connection")
-
-    @mongocache(db_name="flickr_qgis", collection_name="photos", port=27017, \
-                logger=lambda *args: QgsMessageLog.logMessage(" ".join([str(item) for item in args]), "flickr"))
-    def _search_photos(self, boundary, page):
-        if not self.running:
-            self._halt_error()
-            return
+    def _metrics_from_worker(self, snapshot):
+        self.statsLabel.setText(format_snapshot(snapshot))
         
-        self.addMessage.emit("Searching for photos on flickr...")
-        bbox = ','.join([str(coords) for coords in boundary[:4]])
-        startDate, endDate = boundary[4:]
-        startDate = str(startDate)
-        endDate = str(endDate)
-
-        extras = ["geo", "date_taken", "tags", IMAGE_URL_TYPE, "owner_name"]
-
-        params = {
-            "api_key": self.apiKey,
-            "method": "flickr.photos.search",
-            "bbox": bbox,
-            "accuracy": LOCATION_ACCURACY,
-            "format": "json",
-            "nojsoncallback": 1,
-            "page": page,
-            "perpage": RES_PER_PAGE,
-            "min_taken_date": startDate,
-            "max_taken_date": endDate,
-            "extras": ",".join(extras),
-            "media": "photos"
-        }
-        url = f"https://api.flickr.com/services/rest/"
-
-        try:
-            r = self.flickr_session.get(url, params=params, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
-        except:
-            return None
-        else:
-            data = r.json()
-
-            if data['stat'] == 'ok':
-                self.addMessage.emit('fetched photo metadata successfully')
-            elif data['stat'] == 'fail':
-                self.addMessage.emit(f"Error fetching photo metadata: {data['message']}")
-
-            return data
-         
-    def _save_image(self, url, filepath, filename):
-        r = self.flickr_session.get(url, stream=True)
-        if r.status_code == 200:
-            try:
-                with open(os.path.join(filepath, filename), 'wb') as f:
-                    for chunk in r.iter_content(CHUNK_SIZE):
-                        if not self.running:
-                            self._halt_error()
-                            return
-                        f.write(chunk)
-            except:
-                self.addMessage.emit(f"could not write file {filename}")
-            else:
-                self.addMessage.emit(f"saved file {filename}")
-                return True
-        else:
-            self.addMessage.emit(f"could not write file {filename}")
 
-        r.close()
-        del r
 
-        return False
+class QgsMessageLogHandler(logging.Handler):
+    '''
+        forwards records of the harvester logger to the QGIS message log
+    '''
+    def emit(self, record):
+        QgsMessageLog.logMessage(self.format(record), "flickr")
 
-    def _push_data(self, data, page):
-        self.addMessage.emit(f"pushing page {page} to dataframe...")
 
-        # save to csv file
-        for photo in data['photos']['photo']:
-            if not self.running:
-                self._halt_error()
-                return
+harvestLog = logging.getLogger('flickr')
+harvestLog.setLevel(logging.INFO)
+if not any(isinstance(handler, QgsMessageLogHandler) for handler in harvestLog.handlers):
+    harvestLog.addHandler(QgsMessageLogHandler())
 
-            filepath = self.outputDirName
 
-            filename = f"{photo['id']}_{photo['secret']}{IMAGE_SIZE_SUFFIX}.jpg"
-            url = f"https://live.staticflickr.com/{photo['server']}/{filename}"
-            filename = f"{photo['server']}_{filename}"
+class LayerArea:
+    '''
+        area of interest from the polygons of a layer, with the interface of aoi.PolygonArea
 
-            fallback_filename = f"{photo['id']}_{photo['secret']}_o.jpg"
-            fallback_url = f"https://live.staticflickr.com/{photo['server']}/{fallback_filename}"
-            fallback_filename = f"{photo['server']}_{fallback_filename}"
-            
-            image_filepath = ''
-
-            # download and save photo
-            if self.saveImages:
-                downloaded_flag = self._save_image(url, filepath, filename)
-                if not downloaded_flag:
-                    # TODO: test fallback code
-                    if self._save_image(fallback_url, filepath, fallback_filename):
-                        image_filepath = os.path.join(filepath, fallback_filename)
-                        url = fallback_url
-                else:
-                    image_filepath = os.path.join(filepath, filename)
-
-            self.csvData.append(
-                [photo.get(key, None) for key in self.csvKeys[:-2]] + 
-                [url, image_filepath]
-            )
+        the polygons are merged, reprojected to lon/lat and prepared once; tests from
+        several harvest threads are serialized since a geometry engine is not thread safe
+    '''
+    def __init__(self, layer):
+        transform = QgsCoordinateTransform(layer.crs(), QgsCoordinateReferenceSystem('EPSG:4326'), QgsProject.instance())
 
-            self.downloadCount += 1
-            self.progress.emit(self.downloadCount)
+        geometries = []
+        for feature in layer.getFeatures(QgsFeatureRequest().setNoAttributes()):
+            geometry = QgsGeometry(feature.geometry())
+            if geometry.isEmpty():
+                continue
+            geometry.transform(transform)
+            geometries.append(geometry)
 
-        # self.downloadCount += len(data['photos']['photo'])
-        self.progress.emit(self.downloadCount)
+        self.geometry = QgsGeometry.unaryUnion(geometries)
+        if self.geometry.isNull() or self.geometry.isEmpty():
+            raise ValueError(f"layer {layer.name()} has no polygon")
 
-    def _halt_error(self):
-        self.addMessage.emit("worker halted forcefully")
-        self.finished.emit(pd.DataFrame())
+        rect = self.geometry.boundingBox()
+        self.extent = [rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum()]
 
-    def _get_user_data(self, subg):
-        user_id = subg['owner'].iloc[0]
+        self._lock = threading.Lock()
+        self._engine = QgsGeometry.createGeometryEngine(self.geometry.constGet())
+        self._engine.prepareGeometry()
 
-        params = {
-            "api_key": self.apiKey,
-            "method": "flickr.profile.getProfile",
-            "user_id": user_id,
-            "format": "json",
-            "nojsoncallback": 1,
-        }
+    def intersects(self, bbox):
+        box = QgsGeometry.fromRect(QgsRectangle(*bbox[:4]))
+        with self._lock:
+            return self._engine.intersects(box.constGet())
 
-        url = f"https://api.flickr.com/services/rest/"
-        r = requests.get(url, params=params)
+    def contains(self, lon, lat):
+        point = QgsPoint(lon, lat)
+        with self._lock:
+            return self._engine.contains(point)
 
-        if r.status_code == 200:
-            data = r.json()
 
-            if data['stat'] == 'ok':
-                if 'hometown' in data['profile']:
-                    subg['user_hometown'] = data['profile']['hometown']
-                # subg['user_city'] = data['profile']['city']
-                # subg['user_country'] = data['profile']['country']
-                self.addMessage.emit(f"fetched user data successfully for: {user_id}")
-            elif data['stat'] == 'fail':
-                self.addMessage.emit(f"Error fetching user data: {data['message']}")
+class Worker( QObject ):
+    '''
+        Qt adapter around the harvest engine; relays its callbacks as signals
+
+        log lines, progress, total and metrics are buffered as they arrive and only
+        emitted by flush(), which the dialog calls on a timer. every flush emits at most
+        one signal of each kind, so the gui cost per second does not grow with the
+        harvest rate. errors are rare and emitted immediately.
+    '''
+    # pandas DataFrame; typed as object so this module does not import pandas
+    finished = pyqtSignal(object)
+    progress = pyqtSignal(int)
+    # list of (level, message) pairs
+    addMessages = pyqtSignal(list)
+    addError = pyqtSignal(str)
+    total = pyqtSignal(int)
+    metrics = pyqtSignal(dict)
 
-        return subg
-    
-    def run(self):
-        self.downloadCount = 0
-        self.running = True
+    def __init__(self, boundary, apiKey, dbFileName, tableName, csvFileName, outputDirName, saveImages, area=None, boxQueue=None, useCache=True):
+        QObject.__init__(self)
+        from .harvester import Harvester
 
-        # check if api key is valid
-        apiKeyValid = self._check_api_key()
+        self.dbFileName = dbFileName
+        self.tableName = tableName
 
-        if not apiKeyValid:
-            self.addError.emit("Error: invalid API key")
-            self.finished.emit(pd.DataFrame())
-            return
+        self._lock = threading.Lock()
+        self._messages = []
+        self._progress = None
+        self._total = None
+        self._metrics = None
+
+        self.harvester = Harvester(
+            boundary, apiKey, csvFileName, outputDirName, saveImages,
+            onMessage=self._buffer_message,
+            onError=self.addError.emit,
+            onProgress=self._buffer_progress,
+            onTotal=self._buffer_total,
+            onMetrics=self._buffer_metrics,
+            useCache=useCache,
+            area=area,
+            boxQueue=boxQueue
+        )
 
-        if not self.running:
-            self._halt_error()
-            return
+    def stop(self):
+        self.harvester.stop()
+
+    def _buffer_message(self, message, level=logging.INFO):
+        with self._lock:
+            self._messages.append((level, message))
+
+    def _buffer_progress(self, progress):
+        with self._lock:
+            self._progress = progress
+
+    def _buffer_total(self, total):
+        with self._lock:
+            self._total = total
+
+    def _buffer_metrics(self, snapshot):
+        with self._lock:
+            self._metrics = snapshot
+
+    def flush(self):
+        with self._lock:
+            messages, self._messages = self._messages, []
+            total, self._total = self._total, None
+            progress, self._progress = self._progress, None
+            metrics, self._metrics = self._metrics, None
+
+        if messages:
+            self.addMessages.emit(messages)
+        if total is not None:
+            self.total.emit(total)
+        if progress is not None:
+            self.progress.emit(progress)
+        if metrics is not None:
+            self.metrics.emit(metrics)
 
+    def run(self):
         # TODO: fix read only database issue
         # establish connection to database (spatialite)
         # try:
@@ -721,127 +729,6 @@ class Worker( QObject ):
         #     self.addMessage.emit(f"old table dropped if any.")
         #     self.addMessage.emit(f"created new table {self.tableName}.")
 
-        # create session object
-        self.flickr_session = requests.Session()
-
-        # recursively download all metadata
-        bboxes = deque()
-        bboxes.append(self.boundary)
-
-        first = True
-
-        # main loop
-        while len(bboxes) and self.running:
-            # halt if halted
-            if not self.running:
-                self._halt_error()
-                return
-            # recursively generate new queries to download all metadata
-            bbox = bboxes.popleft()
-            self.addMessage.emit(f"Downloading Box: {bbox[3]}°N-{bbox[1]}°S {bbox[2]}°E-{bbox[0]}°W {bbox[4].date()}->{bbox[5].date()}")
-
-            # download
-            page = 1
-            data = self._search_photos(bbox, page)
-
-            if data is None:
-                # search request timeout
-                # verdict: move on to next box
-                self.addMessage.emit("request timeout")
-                continue
-
-            if data['stat'] == 'fail':
-                # search request failure
-                # verdict: move on to next box
-                self.addMessage.emit(data['message'])
-                continue
-                # self.finished.emit(pd.DataFrame())
-                # return
-
-            pages = data['photos']['pages']
-
-            if pages == 0:
-                if first:
-                    # first search returns no results
-                    # verdict: return control
-                    self.addError.emit('no results found within given box')
-                    self.finished.emit(pd.DataFrame())
-                    return
-                else:
-                    # recursive search returns no results
-                    # verdict: move on to next bbox
-                    self.addMessage.emit('no results found within given box')
-                    continue
-
-            if first:
-                first = False
-                self.totalRecordCount = data['photos']['total']
-                self.total.emit(self.totalRecordCount)
-                self.addMessage.emit(f"downloading all {self.totalRecordCount} {'records' if self.totalRecordCount > 1 else 'record'}")
-
-            if pages > MAX_SAME_QUERIES:
-                # too many same queries; dividing the box
-                W, S, E, N, startDate, endDate = bbox
-
-                if abs(N - S) > BOX_DIVISION_THRESHOLD and abs(E - W) > BOX_DIVISION_THRESHOLD:
-                    # box big enough to be divided
-                    self.addMessage.emit(f"{pages} pages. dividing spatially...")
-                    mid_long = (E + W) / 2
-                    mid_lat = (N + S) / 2
-                    bboxes.append([W, mid_lat, mid_long, N, startDate, endDate])
-                    bboxes.append([mid_long, mid_lat, E, N, startDate, endDate])
-                    bboxes.append([mid_long, S, E, mid_lat, startDate, endDate])
-                    bboxes.append([W, S, mid_long, mid_lat, startDate, endDate])
-                else:
-                    # box not big enough. dividing temporally
-                    self.addMessage.emit(f"{pages} pages. dividing temporally...")
-                    midDate = datetime.fromtimestamp((startDate.timestamp() + endDate.timestamp()) / 2)
-                    bboxes.append([W, S, E, N, startDate, midDate])
-                    bboxes.append([W, S, E, N, midDate, endDate])
-            else:
-                self._push_data(data, page)
-                while page < pages:
-                    page += 1
-                    data = self._search_photos(bbox, page)
-                    if data == None:
-                        return
-                    if data['stat'] == 'fail':
-                        self.addError.emit(data['message'])
-                        self.finished.emit(pd.DataFrame())
-                        return
-                    self._push_data(data, page)
-                    pages = data['photos']['pages']
-
-        self.addMessage.emit(f"Finished downloading all {self.totalRecordCount} records")
-
-        self.addMessage.emit('dropping duplicates...')
-
-        try:
-            self.df = pd.DataFrame(self.csvData)
-            self.df.columns = self.csvKeys
-
-            self.addMessage.emit(f"found {self.df.shape[0] - self.df[self.UNIQUE_KEY].unique().shape[0]} duplicates. dropping...")
-
-            self.df.drop_duplicates(subset=[self.UNIQUE_KEY], inplace=True)
-
-            del self.csvData
-        except Exception as ex:
-            self.addMessage.emit(ex)
-
-        self.df = self.df.groupby('owner').apply(self._get_user_data)
-
-
-        self.addMessage.emit("flushing data into csv file...")
-        try:
-            with open(self.csvFileName, 'w') as f:
-                self.df.to_csv(f, line_terminator='\n')
-        except Exception as ex:
-            self.addError.emit(f"Error : {ex}")
-            self.finished.emit(pd.DataFrame())
-            return
-        else:
-            self.addMessage.emit("csv file saved")
-
-        self.running = False
-        self.finished.emit(self.df)
-        return
+        df = self.harvester.run()
+        self.flush()
+        self.finished.emit(df)
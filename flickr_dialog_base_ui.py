@@ -82,9 +82,26 @@ class Ui_FlickrDialogBase(object):
         self.progressBar.setGeometry(QtCore.QRect(10, 640, 761, 23))
         self.progressBar.setProperty("value", 24)
         self.progressBar.setObjectName("progressBar")
-        self.logBox = QtWidgets.QTextBrowser(FlickrDialogBase)
+        self.logBox = QtWidgets.QPlainTextEdit(FlickrDialogBase)
         self.logBox.setGeometry(QtCore.QRect(10, 340, 761, 201))
+        self.logBox.setReadOnly(True)
         self.logBox.setObjectName("logBox")
+        self.pinViewButton = QtWidgets.QPushButton(FlickrDialogBase)
+        self.pinViewButton.setEnabled(False)
+        self.pinViewButton.setGeometry(QtCore.QRect(230, 250, 151, 31))
+        self.pinViewButton.setObjectName("pinViewButton")
+        self.aoiLabel = QtWidgets.QLabel(FlickrDialogBase)
+        self.aoiLabel.setGeometry(QtCore.QRect(10, 300, 71, 27))
+        self.aoiLabel.setObjectName("aoiLabel")
+        self.aoiLayer = QtWidgets.QComboBox(FlickrDialogBase)
+        self.aoiLayer.setGeometry(QtCore.QRect(90, 300, 291, 27))
+        self.aoiLayer.setObjectName("aoiLayer")
+        self.logLevelLabel = QtWidgets.QLabel(FlickrDialogBase)
+        self.logLevelLabel.setGeometry(QtCore.QRect(590, 305, 81, 27))
+        self.logLevelLabel.setObjectName("logLevelLabel")
+        self.logLevel = QtWidgets.QComboBox(FlickrDialogBase)
+        self.logLevel.setGeometry(QtCore.QRect(671, 305, 100, 27))
+        self.logLevel.setObjectName("logLevel")
         self.startDate = QtWidgets.QDateEdit(FlickrDialogBase)
         self.startDate.setGeometry(QtCore.QRect(90, 200, 131, 31))
         self.startDate.setObjectName("startDate")
@@ -118,6 +135,10 @@ class Ui_FlickrDialogBase(object):
         self.saveLogCheck = QtWidgets.QCheckBox(FlickrDialogBase)
         self.saveLogCheck.setGeometry(QtCore.QRect(10, 550, 231, 41))
         self.saveLogCheck.setObjectName("saveLogCheck")
+        self.statsLabel = QtWidgets.QLabel(FlickrDialogBase)
+        self.statsLabel.setGeometry(QtCore.QRect(250, 550, 521, 41))
+        self.statsLabel.setWordWrap(True)
+        self.statsLabel.setObjectName("statsLabel")
         self.outputDirName = QtWidgets.QLineEdit(FlickrDialogBase)
         self.outputDirName.setGeometry(QtCore.QRect(540, 260, 191, 31))
         self.outputDirName.setObjectName("outputDirName")
@@ -162,3 +183,8 @@ class Ui_FlickrDialogBase(object):
         self.outputDirPicker.setText(_translate("FlickrDialogBase", "..."))
         self.label_11.setText(_translate("FlickrDialogBase", "Output Folder"))
         self.saveImages.setText(_translate("FlickrDialogBase", "Save Images?"))
+        self.pinViewButton.setToolTip(_translate("FlickrDialogBase", "harvest the area shown on the map first"))
+        self.pinViewButton.setText(_translate("FlickrDialogBase", "Pin current view"))
+        self.aoiLabel.setText(_translate("FlickrDialogBase", "Area"))
+        self.aoiLayer.setToolTip(_translate("FlickrDialogBase", "polygon layer to harvest within; boxes and photos outside it are skipped"))
+        self.logLevelLabel.setText(_translate("FlickrDialogBase", "Log level"))
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+"""
+
+import os
+import re
+from collections import OrderedDict
+
+from qgis.PyQt.QtCore import Qt, QAbstractListModel, QModelIndex, QPoint, QSize, QUrl, QTimer
+from qgis.PyQt.QtGui import QPixmap, QImageReader
+from qgis.PyQt.QtNetwork import QNetworkRequest, QNetworkReply
+from qgis.PyQt.QtWidgets import QWidget, QListView, QVBoxLayout
+
+from qgis.core import QgsFeatureRequest
+
+from .constants import THUMBNAIL_SIZE, THUMBNAIL_SUFFIX, GALLERY_BLOCK_SIZE, GALLERY_CACHE_SIZE
+
+
+def thumbnail_url(link):
+    '''
+        rewrites a static flickr image url to the thumbnail size
+        https://live.staticflickr.com/{server}/{id}_{secret}[_{suffix}].jpg
+    '''
+    return re.sub(r'/(\d+_[0-9a-f]+)(_[0-9a-z]+)?\.jpg$', rf'/\1{THUMBNAIL_SUFFIX}.jpg', link)
+
+
+class GalleryModel(QAbstractListModel):
+    '''
+        virtualized list model over the ids of selected marker features
+
+        - only feature ids are held for the whole selection
+        - attributes are read from the layer in blocks when a row is first asked for
+        - thumbnails are requested only for rows the view paints or prefetches
+        - attributes and thumbnails are kept in bounded LRU caches
+    '''
+    AttributesRole = Qt.UserRole + 1
+
+    def __init__(self, networkManager, parent=None):
+        super().__init__(parent)
+        self.networkManager = networkManager
+
+        self.layer = None
+        self.fids = []
+
+        # row -> attributes / thumbnail, least recently used first
+        self._attributes = OrderedDict()
+        self._thumbnails = OrderedDict()
+        # row -> reply of thumbnail request in flight
+        self._pending = dict()
+
+        self._placeholder = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self._placeholder.fill(Qt.lightGray)
+
+    def setFeatures(self, layer, fids):
+        self.beginResetModel()
+        self._abort_pending(lambda row: True)
+        self.layer = layer
+        self.fids = list(fids)
+        self._attributes.clear()
+        self._thumbnails.clear()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.fids)
+
+    def _fetch_block(self, row):
+        # read the whole block around the row in one feature request
+        start = row - row % GALLERY_BLOCK_SIZE
+        rowOf = {self.fids[r]: r for r in range(start, min(start + GALLERY_BLOCK_SIZE, len(self.fids)))}
+
+        request = QgsFeatureRequest().setFilterFids(list(rowOf)).setFlags(QgsFeatureRequest.NoGeometry)
+        for feature in self.layer.getFeatures(request):
+            self._attributes[rowOf[feature.id()]] = feature.attributes()
+
+        while len(self._attributes) > GALLERY_CACHE_SIZE:
+            self._attributes.popitem(last=False)
+
+    def attributes(self, row):
+        if row not in self._attributes:
+            self._fetch_block(row)
+        else:
+            self._attributes.move_to_end(row)
+        return self._attributes.get(row, None)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or self.layer is None:
+            return None
+
+        row = index.row()
+        attrs = self.attributes(row)
+        if attrs is None:
+            return None
+
+        title, tags, datetaken, link, ownername, filepath = attrs
+
+        if role == Qt.DisplayRole:
+            return title if len(title) else "no title"
+        elif role == Qt.ToolTipRole:
+            return f"{ownername}\n{datetaken}"
+        elif role == Qt.DecorationRole:
+            if row not in self._thumbnails:
+                self.loadThumbnail(row)
+            else:
+                self._thumbnails.move_to_end(row)
+            return self._thumbnails.get(row, self._placeholder)
+        elif role == self.AttributesRole:
+            return attrs
+        return None
+
+    def _store_thumbnail(self, row, pixmap):
+        self._thumbnails[row] = pixmap
+        while len(self._thumbnails) > GALLERY_CACHE_SIZE:
+            self._thumbnails.popitem(last=False)
+
+    def loadThumbnail(self, row):
+        if row in self._thumbnails or row in self._pending:
+            return
+
+        attrs = self.attributes(row)
+        if attrs is None:
+            return
+        link, filepath = attrs[3], attrs[5]
+
+        if isinstance(filepath, str) and len(filepath) and os.path.isfile(filepath):
+            # decode the saved image directly at thumbnail size
+            reader = QImageReader(filepath)
+            size = reader.size()
+            if size.isValid():
+                reader.setScaledSize(size.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.KeepAspectRatio))
+            image = reader.read()
+            if not image.isNull():
+                self._store_thumbnail(row, QPixmap.fromImage(image))
+                return
+
+        reply = self.networkManager.get(QNetworkRequest(QUrl(thumbnail_url(link))))
+        self._pending[row] = reply
+        reply.finished.connect(lambda row=row, reply=reply: self._thumbnail_loaded(row, reply))
+
+    def _thumbnail_loaded(self, row, reply):
+        reply.deleteLater()
+
+        # reply belongs to an aborted request or an earlier selection
+        if self._pending.get(row, None) is not reply:
+            return
+        del self._pending[row]
+
+        if reply.error() != QNetworkReply.NoError:
+            return
+
+        pixmap = QPixmap()
+        pixmap.loadFromData(reply.readAll())
+        if pixmap.isNull():
+            return
+
+        self._store_thumbnail(row, pixmap.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def _abort_pending(self, predicate):
+        for row in [row for row in self._pending if predicate(row)]:
+            reply = self._pending.pop(row)
+            reply.abort()
+
+    def prefetch(self, first, last):
+        '''
+            loads thumbnails for the screen after the visible rows [first, last]
+            and drops requests that have scrolled out of reach
+        '''
+        span = last - first + 1
+        self._abort_pending(lambda row: row < first - span or row > last + 2 * span)
+
+        for row in range(last + 1, min(last + 1 + span, len(self.fids))):
+            self.loadThumbnail(row)
+
+
+class GalleryWidget(QWidget):
+    '''
+        single window showing every selected photo as a thumbnail grid
+        double clicking a thumbnail opens its popup
+    '''
+    def __init__(self, networkManager, popups, parent=None):
+        super().__init__(parent)
+        self.popups = popups
+
+        self.model = GalleryModel(networkManager, self)
+
+        self.view = QListView(self)
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setMovement(QListView.Static)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setBatchSize(GALLERY_BLOCK_SIZE)
+        self.view.setWordWrap(True)
+        self.view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.view.setGridSize(QSize(THUMBNAIL_SIZE + 20, THUMBNAIL_SIZE + 40))
+        self.view.setModel(self.model)
+
+        self.view.doubleClicked.connect(self._open_popup)
+        self.view.verticalScrollBar().valueChanged.connect(self._prefetch)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.view)
+
+        self.resize(800, 600)
+
+    def setFeatures(self, layer, fids):
+        self.model.setFeatures(layer, fids)
+        self.setWindowTitle(f"{len(fids)} photos")
+        self.show()
+        self.raise_()
+
+        # prefetch once the view has laid out the first screen
+        QTimer.singleShot(0, self._prefetch)
+
+    def _prefetch(self, *args):
+        rows = self.model.rowCount()
+        if rows == 0:
+            return
+
+        grid = self.view.gridSize()
+
+        # probe the centre of the top left grid cell; the corner may fall between items
+        first = self.view.indexAt(QPoint(grid.width() // 2, grid.height() // 2))
+        first = first.row() if first.isValid() else 0
+
+        viewport = self.view.viewport().size()
+        columns = max(1, viewport.width() // grid.width())
+        lines = viewport.height() // grid.height() + 1
+
+        last = min(first + columns * lines - 1, rows - 1)
+        self.model.prefetch(first, last)
+
+    def _open_popup(self, index):
+        attrs = index.data(GalleryModel.AttributesRole)
+        if attrs is not None:
+            key = (self.model.layer.id(), self.model.fids[index.row()])
+            self.popups.show_feature(key, attrs)
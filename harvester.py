@@ -0,0 +1,874 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+
+ harvest engine; pure python and free of any Qt / QGIS dependency so it can
+ run inside the plugin worker thread, from the command line or as a library
+"""
+
+import os
+import requests
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import glob
+import socket
+import sys
+import logging
+import threading
+import sqlite3
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'mongocache'))
+
+from mongocache import mongocache
+
+from .constants import IMAGE_SIZE_SUFFIX, IMAGE_URL_TYPE, LOCATION_ACCURACY, RES_PER_PAGE, \
+    MAX_SAME_QUERIES, BOX_DIVISION_THRESHOLD, CHUNK_SIZE, KEY_RATE_LIMIT, KEY_RATE_LIMITED_CODE, \
+    THREADS_PER_KEY, QUEUE_POLL_INTERVAL, MAX_RES_PER_QUERY, DATE_TAKEN_FORMAT, SEARCH_CACHE_LIFE
+from .metrics import Metrics, timed
+from .keypool import KeyPool
+from .boxqueue import BoxQueue, SqliteBoxQueue
+from .aoi import clip_boundary
+
+log = logging.getLogger('flickr')
+
+
+def is_connected():
+    try:
+        # connect to the host google.com -- tells us if the host is actually reachable
+        socket.create_connection(("1.1.1.1", 53))
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def _noop(*args):
+    pass
+
+
+def _cacheable(data):
+    '''
+        only successful searches are cached; timeouts, stopped searches and
+        failures (a key over its rate limit, say) are searched again next time
+    '''
+    return data is not None and data.get('stat', None) == 'ok'
+
+
+def partition_path(csvFileName, node):
+    '''
+        csv file a node writes its share of a multi-node harvest to
+    '''
+    stem, ext = os.path.splitext(csvFileName)
+    return f"{stem}.part-{node}{ext or '.csv'}"
+
+
+def merge_partitions(csvFileName, uniqueKey=IMAGE_URL_TYPE):
+    '''
+        merges the partitions written by every node into csvFileName, dropping
+        photos harvested by more than one node
+
+        Returns:
+            number of photos in the merged file
+    '''
+    stem, ext = os.path.splitext(csvFileName)
+    parts = sorted(glob.glob(f"{glob.escape(stem)}.part-*{ext or '.csv'}"))
+    if len(parts) == 0:
+        raise FileNotFoundError(f"no partitions of {csvFileName} found")
+
+    df = pd.concat([pd.read_csv(part, index_col=0) for part in parts], ignore_index=True)
+    df.drop_duplicates(subset=[uniqueKey], inplace=True)
+    df.reset_index(drop=True, inplace=True)
+
+    with open(csvFileName, 'w', newline='') as f:
+        df.to_csv(f)
+    return len(df)
+
+
+def slice_dates(bbox, count):
+    '''
+        cuts a box into count boxes of equal date ranges
+    '''
+    W, S, E, N, startDate, endDate = bbox
+    step = (endDate - startDate) / count
+    return [[W, S, E, N, startDate + step * i, endDate if i == count - 1 else startDate + step * (i + 1)] for i in range(count)]
+
+
+def split_box(bbox):
+    '''
+        splits a box holding more results than flickr serves for one query
+
+        Returns:
+            (child boxes, 'spatially' or 'temporally')
+    '''
+    W, S, E, N, startDate, endDate = bbox
+
+    if abs(N - S) > BOX_DIVISION_THRESHOLD and abs(E - W) > BOX_DIVISION_THRESHOLD:
+        # box big enough to be divided
+        mid_long = (E + W) / 2
+        mid_lat = (N + S) / 2
+        return [
+            [W, mid_lat, mid_long, N, startDate, endDate],
+            [mid_long, mid_lat, E, N, startDate, endDate],
+            [mid_long, S, E, mid_lat, startDate, endDate],
+            [W, S, mid_long, mid_lat, startDate, endDate]
+        ], "spatially"
+
+    # box not big enough. dividing temporally
+    midDate = datetime.fromtimestamp((startDate.timestamp() + endDate.timestamp()) / 2)
+    return [
+        [W, S, E, N, startDate, midDate],
+        [W, S, E, N, midDate, endDate]
+    ], "temporally"
+
+
+class Harvester:
+    '''
+        downloads metadata (and optionally images) of every geotagged flickr photo
+        within a boundary [west, south, east, north, startDate, endDate]
+
+        apiKey may be one key or a list of keys. boxes are searched by
+        len(keys) * THREADS_PER_KEY threads that share a KeyPool, so throughput
+        grows with the number of keys; keyRate is the hourly budget of every key
+        (None for no budget)
+
+        with a queueFile the box queue lives in a SqliteBoxQueue that harvests on
+        other nodes share. every node writes its photos to partition_path(csvFileName, node)
+        and the last node to stop merges the partitions into csvFileName. nodes that
+        failed or stopped beating do not hold the merge up
+
+        a plan made by planner.Planner for the same boundary seeds the queue with
+        its leaf boxes, skipping every search that only led to a subdivision
+
+        with cursor=True boxes are walked by date taken instead of by page number
+        and never subdivided; the root is cut into one time slice per thread
+
+        an area of interest (aoi.PolygonArea or anything with the same interface)
+        shrinks the boundary to its extent, drops queued boxes that miss it before
+        any API call and drops photos outside it before they are saved
+
+        boxQueue replaces the default FIFO BoxQueue of a single node harvest, e.g.
+        by a PriorityBoxQueue that the caller reprioritizes while the harvest runs
+
+        progress is reported through plain callables:
+            onMessage(str, level) : log line with a logging level; chatter per
+                                    request and photo is logged at DEBUG
+            onError(str)          : error to be shown to the user
+            onProgress(int)       : number of photos processed so far
+            onTotal(int)          : total number of photos reported by the first search
+            onMetrics(dict)       : snapshot of self.metrics, after every page and at the end
+    '''
+    UNIQUE_KEY = IMAGE_URL_TYPE
+
+    CONNECT_TIMEOUT = 10
+    READ_TIMEOUT = 60
+
+    API_URL = "https://api.flickr.com/services/rest/"
+    STATIC_URL = "https://live.staticflickr.com"
+
+    def __init__(self, boundary, apiKey, csvFileName, outputDirName, saveImages, \
+                 onMessage=None, onError=None, onProgress=None, onTotal=None, onMetrics=None, useCache=True, \
+                 keyRate=KEY_RATE_LIMIT, queueFile=None, node=None, plan=None, cursor=False, area=None, \
+                 boxQueue=None):
+        if area is not None:
+            boundary = clip_boundary(boundary, area)
+            if boundary is None:
+                raise ValueError("the area of interest lies outside the boundary")
+        self.boundary = boundary
+        self.area = area
+        self.apiKeys = [apiKey] if isinstance(apiKey, str) else list(apiKey)
+        self.keyRate = keyRate
+        self.queueFile = queueFile
+        self.plan = plan
+        self.cursor = cursor
+        self.boxQueue = boxQueue
+        self.node = node or f"{socket.gethostname()}-{os.getpid()}"
+        self.csvFileName = csvFileName
+        self.outputDirName = outputDirName
+        self.saveImages = saveImages
+        self.useCache = useCache
+
+        self.onMessage = onMessage or _noop
+        self.onError = onError or _noop
+        self.onProgress = onProgress or _noop
+        self.onTotal = onTotal or _noop
+        self.onMetrics = onMetrics or _noop
+
+        self.metrics = Metrics()
+
+        self.running = None
+        self.failed = False
+        self.keyPool = None
+        self.downloadCount = 0
+        self.totalRecordCount = 0
+        # deepest level of box subdivision reached
+        self.maxDepth = 0
+
+        self.csvData = []
+        self.df = None
+        self._lock = threading.Lock()
+        self._sessions = threading.local()
+        self.csvKeys = ["id", "owner", "place_id", "latitude", "longitude", "datetaken", "accuracy", "title", "tags", "ownername", IMAGE_URL_TYPE, "filepath"]
+
+    def stop(self):
+        self.running = False
+
+    @property
+    def flickr_session(self):
+        # requests sessions are not thread safe; one per harvest thread
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = self._sessions.session = requests.Session()
+        return session
+
+    def _check_api_key(self, apiKey):
+        self.onMessage("checking connection to flickr API...")
+        url = f"{self.API_URL}?api_key={apiKey}&method=flickr.test.echo&format=json&nojsoncallback=1"
+        r = requests.get(url)
+
+        if r.status_code == 200:
+            data = r.json()
+            if data['stat'] == 'ok':
+                self.onMessage("Connection OK")
+                return True
+            elif data['stat'] == 'fail':
+                self.onMessage(f"Error: {data['message']}", logging.WARNING)
+                return False
+        else:
+            if is_connected():
+                self.onError(f"Error: {r.text}")
+            else:
+                self.onError(f"Check Internet connection")
+
+    def _check_api_keys(self):
+        '''
+            drops invalid keys from the pool
+
+            Returns:
+                True if at least one key is valid
+        '''
+        valid = False
+        for apiKey in self.apiKeys:
+            if self._check_api_key(apiKey):
+                valid = True
+            else:
+                self.keyPool.retire(apiKey, permanent=True)
+        return valid
+
+    def _acquire_key(self):
+        '''
+            Returns:
+                an API key with budget left; None when halted or no key is usable any more
+        '''
+        while self.running:
+            apiKey = self.keyPool.acquire(timeout=QUEUE_POLL_INTERVAL)
+            if apiKey is not None:
+                return apiKey
+            if self.keyPool.exhausted():
+                return None
+        return None
+
+    def _search_params(self, boundary, page, perPage=RES_PER_PAGE, extras=True):
+        bbox = ','.join([str(coords) for coords in boundary[:4]])
+        startDate, endDate = boundary[4:]
+        startDate = str(startDate)
+        endDate = str(endDate)
+
+        params = {
+            "method": "flickr.photos.search",
+            "bbox": bbox,
+            "accuracy": LOCATION_ACCURACY,
+            "format": "json",
+            "nojsoncallback": 1,
+            "page": page,
+            "per_page": perPage,
+            "min_taken_date": startDate,
+            "max_taken_date": endDate,
+            "media": "photos"
+        }
+        if extras:
+            params["extras"] = ",".join(["geo", "date_taken", "tags", IMAGE_URL_TYPE, "owner_name"])
+        return params
+
+    def _query(self, params, name='search'):
+        '''
+            sends one API call with a key from the pool; a key refused by flickr
+            is retired and the call retried with another one
+
+            Returns:
+                decoded response; None on timeout or when no key is left
+        '''
+        data = None
+        for attempt in range(len(self.keyPool)):
+            apiKey = self._acquire_key()
+            if apiKey is None:
+                return None
+            params["api_key"] = apiKey
+
+            try:
+                with self.metrics.timer(f'{name}_request'):
+                    r = self.flickr_session.get(self.API_URL, params=params, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+            except:
+                return None
+
+            self.metrics.count(f'requests.{name}')
+            self.metrics.count(f'bytes.{name}', len(r.content))
+            if r.status_code == KEY_RATE_LIMITED_CODE:
+                data = {"stat": "fail", "code": r.status_code, "message": "API key over its rate limit"}
+            else:
+                data = r.json()
+
+            if not self.keyPool.report(apiKey, data):
+                break
+            self.metrics.count('keys.retired')
+
+        return data
+
+    def _search(self, boundary, page, sort=None):
+        if not self.running:
+            return
+
+        if self.useCache:
+            # only searches the cache did not answer get here
+            self.metrics.count('cache.misses')
+
+        self.onMessage("Searching for photos on flickr...", logging.DEBUG)
+        params = self._search_params(boundary, page)
+        if sort is not None:
+            params["sort"] = sort
+        data = self._query(params)
+
+        if data is not None:
+            if data['stat'] == 'ok':
+                self.onMessage('fetched photo metadata successfully', logging.DEBUG)
+            elif data['stat'] == 'fail':
+                self.onMessage(f"Error fetching photo metadata: {data['message']}", logging.WARNING)
+
+        return data
+
+    def _cached(self, search, boundary, page):
+        '''
+            one search through the cache, counted once however many requests it takes
+        '''
+        if self.useCache:
+            self.metrics.count('cache.lookups')
+        return search(boundary, page, ignore_index=not self.useCache)
+
+    @timed('search')
+    @mongocache(db_name="flickr_qgis", collection_name="photos", port=27017, backend="auto", hash_keys=True, \
+                shelf_life=timedelta(seconds=SEARCH_CACHE_LIFE), ttl=True, cacheable=_cacheable, \
+                logger=lambda *args: log.info(" ".join([str(item) for item in args])))
+    def _search_photos(self, boundary, page):
+        return self._search(boundary, page)
+
+    @timed('search')
+    @mongocache(db_name="flickr_qgis", collection_name="photos_by_date", port=27017, backend="auto", hash_keys=True, \
+                shelf_life=timedelta(seconds=SEARCH_CACHE_LIFE), ttl=True, cacheable=_cacheable, \
+                logger=lambda *args: log.info(" ".join([str(item) for item in args])))
+    def _search_photos_by_date(self, boundary, page):
+        # oldest first, so the last photo of a page is the cursor for the next query
+        return self._search(boundary, page, sort="date-taken-asc")
+
+    @timed('save_image')
+    def _save_image(self, url, filepath, filename):
+        r = self.flickr_session.get(url, stream=True)
+        self.metrics.count('requests.images')
+        if r.status_code == 200:
+            try:
+                with open(os.path.join(filepath, filename), 'wb') as f:
+                    for chunk in r.iter_content(CHUNK_SIZE):
+                        if not self.running:
+                            return False
+                        f.write(chunk)
+                        self.metrics.count('bytes.images', len(chunk))
+            except:
+                self.onMessage(f"could not write file {filename}", logging.WARNING)
+            else:
+                self.onMessage(f"saved file {filename}", logging.DEBUG)
+                return True
+        else:
+            self.onMessage(f"could not write file {filename}", logging.WARNING)
+
+        r.close()
+        del r
+
+        return False
+
+    @timed('push_data')
+    def _push_data(self, data, page):
+        self.onMessage(f"pushing page {page} to dataframe...", logging.DEBUG)
+
+        # save to csv file
+        for photo in data['photos']['photo']:
+            if not self.running:
+                return
+
+            if self.area is not None and not self.area.contains(float(photo['longitude']), float(photo['latitude'])):
+                self.metrics.count('photos.clipped')
+                continue
+
+            filepath = self.outputDirName
+
+            filename = f"{photo['id']}_{photo['secret']}{IMAGE_SIZE_SUFFIX}.jpg"
+            url = f"{self.STATIC_URL}/{photo['server']}/{filename}"
+            filename = f"{photo['server']}_{filename}"
+
+            fallback_filename = f"{photo['id']}_{photo['secret']}_o.jpg"
+            fallback_url = f"{self.STATIC_URL}/{photo['server']}/{fallback_filename}"
+            fallback_filename = f"{photo['server']}_{fallback_filename}"
+
+            image_filepath = ''
+
+            # download and save photo
+            if self.saveImages:
+                downloaded_flag = self._save_image(url, filepath, filename)
+                if not downloaded_flag:
+                    # TODO: test fallback code
+                    if self._save_image(fallback_url, filepath, fallback_filename):
+                        image_filepath = os.path.join(filepath, fallback_filename)
+                        url = fallback_url
+                else:
+                    image_filepath = os.path.join(filepath, filename)
+
+            with self._lock:
+                self.csvData.append(
+                    [photo.get(key, None) for key in self.csvKeys[:-2]] +
+                    [url, image_filepath]
+                )
+                self.downloadCount += 1
+                downloadCount = self.downloadCount
+            self.onProgress(downloadCount)
+
+        self.onProgress(self.downloadCount)
+
+    def _halt_error(self):
+        self.onMessage("worker halted forcefully", logging.WARNING)
+        return pd.DataFrame()
+
+    @timed('user_data')
+    def _get_user_data(self, user_id):
+        '''
+            Returns:
+                hometown of the user; None if unknown or the request failed
+        '''
+        hometown = None
+
+        apiKey = self._acquire_key()
+        if apiKey is None:
+            return hometown
+
+        params = {
+            "api_key": apiKey,
+            "method": "flickr.profile.getProfile",
+            "user_id": user_id,
+            "format": "json",
+            "nojsoncallback": 1,
+        }
+
+        # one hung or failed lookup must not hold up the rest of the finish step
+        try:
+            r = self.flickr_session.get(self.API_URL, params=params, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+            self.metrics.count('requests.profile')
+            self.metrics.count('bytes.profile', len(r.content))
+            data = r.json() if r.status_code == 200 else None
+        except (requests.RequestException, ValueError) as ex:
+            self.onMessage(f"could not fetch user data for {user_id}: {ex}", logging.WARNING)
+            return hometown
+
+        if r.status_code == KEY_RATE_LIMITED_CODE:
+            self.keyPool.retire(apiKey)
+        elif data is not None:
+            self.keyPool.report(apiKey, data)
+
+            if data['stat'] == 'ok':
+                hometown = data['profile'].get('hometown', None)
+                # city = data['profile']['city']
+                # country = data['profile']['country']
+                self.onMessage(f"fetched user data successfully for: {user_id}", logging.DEBUG)
+            elif data['stat'] == 'fail':
+                self.onMessage(f"Error fetching user data: {data['message']}", logging.WARNING)
+
+        return hometown
+
+    def _harvest_box(self, bbox, depth, boxes):
+        '''
+            searches one box, then either downloads all of its pages or puts its
+            subdivisions back on the queue
+
+            Returns:
+                False if the harvest has to stop with an error
+        '''
+        self.onMessage(f"Downloading Box: {bbox[3]}°N-{bbox[1]}°S {bbox[2]}°E-{bbox[0]}°W {bbox[4].date()}->{bbox[5].date()}")
+        with self._lock:
+            self.maxDepth = max(self.maxDepth, depth)
+
+        # download
+        page = 1
+        data = self._cached(self._search_photos, bbox, page)
+
+        if not self.running:
+            return True
+
+        if data is None:
+            # search request timeout
+            # verdict: move on to next box
+            self.onMessage("request timeout", logging.WARNING)
+            return True
+
+        if data['stat'] == 'fail':
+            # search request failure
+            # verdict: move on to next box
+            self.onMessage(data['message'], logging.WARNING)
+            return True
+
+        pages = data['photos']['pages']
+
+        if pages == 0:
+            if depth == 0:
+                # first search returns no results
+                # verdict: return control
+                self.onError('no results found within given box')
+                return False
+            else:
+                # recursive search returns no results
+                # verdict: move on to next bbox
+                self.onMessage('no results found within given box')
+                return True
+
+        boxes.observe(bbox, int(data['photos']['total']))
+
+        if depth == 0:
+            self.totalRecordCount = data['photos']['total']
+            self.onTotal(self.totalRecordCount)
+            self.onMessage(f"downloading all {self.totalRecordCount} {'records' if self.totalRecordCount > 1 else 'record'}")
+
+        if pages > MAX_SAME_QUERIES:
+            # too many same queries; dividing the box
+            children, how = split_box(bbox)
+            self.onMessage(f"{pages} pages. dividing {how}...")
+            for child in children:
+                boxes.put(child, depth + 1)
+            return True
+
+        self._push_data(data, page)
+        self.onMetrics(self.metrics.snapshot())
+
+        # the pages of the box already in the cache come back from one lookup
+        cached, missed = {}, set()
+        if self.useCache and pages > 1:
+            hits, misses = self._search_photos.get_many([(bbox, p) for p in range(2, pages + 1)])
+            cached = {call[1]: hit for call, hit in hits}
+            missed = set(call[1] for call in misses)
+
+        while page < pages and self.running:
+            page += 1
+            data = cached.pop(page, None)
+            if data is not None:
+                self.metrics.count('cache.lookups')
+            elif page in missed:
+                # the lookup above already missed; asking the cache again costs another round trip
+                self.metrics.count('cache.lookups')
+                with self.metrics.timer('search'):
+                    data = self._search(bbox, page)
+                if data is not None:
+                    self._search_photos.put_many([((bbox, page), data)])
+            else:
+                data = self._cached(self._search_photos, bbox, page)
+            if data == None:
+                break
+            if data['stat'] == 'fail':
+                self.onError(data['message'])
+                return False
+            self._push_data(data, page)
+            self.onMetrics(self.metrics.snapshot())
+            pages = data['photos']['pages']
+
+        return True
+
+    def _walk_box(self, bbox, depth, boxes):
+        '''
+            cursor mode: downloads a box oldest first, always asking for the first
+            page of the photos taken at or after the last one seen. no query goes
+            past the first pages, so the 4000 result cap never forces a
+            subdivision and uploads made during the walk cannot shift the pages
+
+            Returns:
+                False if the harvest has to stop with an error
+        '''
+        self.onMessage(f"Walking Box: {bbox[3]}°N-{bbox[1]}°S {bbox[2]}°E-{bbox[0]}°W {bbox[4].date()}->{bbox[5].date()}")
+        with self._lock:
+            self.maxDepth = max(self.maxDepth, depth)
+
+        W, S, E, N, cursor, endDate = bbox
+        page = 1
+        first = True
+        # ids of the photos taken exactly at the cursor; the next query returns them again
+        seen = set()
+
+        while self.running:
+            data = self._cached(self._search_photos_by_date, [W, S, E, N, cursor, endDate], page)
+
+            if not self.running:
+                return True
+
+            if data is None:
+                self.onMessage("request timeout", logging.WARNING)
+                return True
+
+            if data['stat'] == 'fail':
+                if first:
+                    self.onMessage(data['message'], logging.WARNING)
+                    return True
+                self.onError(data['message'])
+                return False
+
+            if first:
+                first = False
+                total = int(data['photos']['total'])
+                boxes.observe(bbox, total)
+                if total == 0:
+                    if depth == 0:
+                        self.onError('no results found within given box')
+                        return False
+                    self.onMessage('no results found within given box')
+                    return True
+
+                if self.plan is None:
+                    # cursor boxes never overlap, so their totals add up
+                    with self._lock:
+                        self.totalRecordCount += total
+                        totalRecordCount = self.totalRecordCount
+                    self.onTotal(totalRecordCount)
+                    self.onMessage(f"downloading {total} {'records' if total > 1 else 'record'}")
+
+            photos = data['photos']['photo']
+            perPage = int(data['photos']['perpage'])
+            if len(photos) == 0:
+                break
+
+            last = datetime.strptime(photos[-1]['datetaken'], DATE_TAKEN_FORMAT)
+            data['photos']['photo'] = [photo for photo in photos if photo['id'] not in seen]
+            self._push_data(data, page)
+            self.onMetrics(self.metrics.snapshot())
+
+            if len(photos) < perPage:
+                # last page of the box
+                break
+
+            if last > cursor:
+                cursor, page = last, 1
+                seen = set()
+            elif page * perPage < MAX_RES_PER_QUERY:
+                # a whole page taken within one second; page on at the same cursor
+                page += 1
+            else:
+                self.onMessage(f"more than {MAX_RES_PER_QUERY} photos taken at {cursor}; skipping a second", logging.WARNING)
+                cursor, page = cursor + timedelta(seconds=1), 1
+                seen = set()
+            seen.update(photo['id'] for photo in photos if photo['datetaken'] == photos[-1]['datetaken'])
+
+        return True
+
+    def _drain(self, boxes):
+        '''
+            harvest thread: works through the queue until it is finished, the
+            harvest is halted or another thread failed
+        '''
+        while self.running and not self.failed:
+            item = boxes.get(timeout=QUEUE_POLL_INTERVAL)
+            if item is None:
+                if boxes.finished():
+                    return
+                continue
+
+            if self.area is not None and not self.area.intersects(item.bbox):
+                # box outside the area of interest
+                self.onMessage("box outside the area of interest; skipped", logging.DEBUG)
+                self.metrics.count('boxes.pruned')
+                boxes.done(item)
+                continue
+
+            try:
+                if self.cursor:
+                    ok = self._walk_box(item.bbox, item.depth, boxes)
+                else:
+                    ok = self._harvest_box(item.bbox, item.depth, boxes)
+            except Exception as ex:
+                self.onError(f"Error: {ex}")
+                ok = False
+            finally:
+                boxes.done(item)
+
+            if not ok:
+                self.failed = True
+            elif self.keyPool.exhausted():
+                self.onError("Error: no usable API key left")
+                self.failed = True
+
+    def _start(self):
+        '''
+            resets the state of a previous run and checks the API keys
+
+            Returns:
+                False if there is no valid key
+        '''
+        self.downloadCount = 0
+        self.totalRecordCount = 0
+        self.maxDepth = 0
+        self.csvData = []
+        self.metrics = Metrics()
+        self.running = True
+        self.failed = False
+        self.keyPool = KeyPool(self.apiKeys, ratePerHour=self.keyRate, onMessage=self.onMessage)
+
+        # check if api keys are valid
+        if not self._check_api_keys():
+            self.onError("Error: invalid API key")
+            return False
+        return True
+
+    def _work(self, boxes):
+        '''
+            drains the queue on one thread per key, or on the calling thread for a single key
+        '''
+        threadCount = len(self.apiKeys) * THREADS_PER_KEY
+        if threadCount > 1:
+            self.onMessage(f"harvesting with {len(self.apiKeys)} API keys on {threadCount} threads")
+            threads = [threading.Thread(target=self._drain, args=(boxes,), daemon=True) for _ in range(threadCount)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            self._drain(boxes)
+
+    def run(self):
+        '''
+            runs the harvest to completion
+
+            Returns:
+                dataframe of all harvested photos; empty on error or when halted
+        '''
+        if not self._start():
+            return pd.DataFrame()
+
+        if not self.running:
+            return self._halt_error()
+
+        # a plan replaces the boundary by its leaf boxes; their probes are already done
+        items = None
+        if self.plan is not None:
+            if self.plan['boundary'] != list(self.boundary):
+                self.onError("Error: the plan was made for another boundary")
+                return pd.DataFrame()
+            items = [(leaf['bbox'], leaf['depth']) for leaf in self.plan['leaves']]
+            self.totalRecordCount = self.plan['photos']
+            self.onTotal(self.totalRecordCount)
+            self.onMessage(f"following a plan of {len(items)} boxes")
+        elif self.cursor and len(self.apiKeys) * THREADS_PER_KEY > 1:
+            # cursor walks are sequential; give every thread a slice of the date range
+            items = [(bbox, 1) for bbox in slice_dates(self.boundary, len(self.apiKeys) * THREADS_PER_KEY)]
+
+        # recursively download all metadata
+        # queue entries are (box, subdivision depth)
+        if self.queueFile:
+            try:
+                boxes = SqliteBoxQueue(self.queueFile, self.node)
+                if not boxes.seed(self.boundary, items):
+                    self.onMessage(f"joining the harvest in {self.queueFile} as {self.node}")
+            except (ValueError, OSError, sqlite3.Error) as ex:
+                self.onError(f"Error: {ex}")
+                return pd.DataFrame()
+            csvFileName = partition_path(self.csvFileName, self.node)
+        else:
+            boxes = self.boxQueue if self.boxQueue is not None else BoxQueue()
+            boxes.seed(self.boundary, items)
+            csvFileName = self.csvFileName
+
+        # a node that stops, fails or raises before writing its partition is failed
+        state = 'failed'
+        try:
+            # main loop
+            self._work(boxes)
+
+            if self.cursor and not self.failed and self.running and self.totalRecordCount == 0 and self.plan is None:
+                self.onError('no results found within given box')
+                return pd.DataFrame()
+
+            df = self._finish(csvFileName)
+            # a node that found nothing still wrote an empty partition
+            if not self.failed and os.path.exists(csvFileName):
+                state = 'done'
+            return df
+        finally:
+            try:
+                # the last node to stop merges, whether or not the others all succeeded
+                if self.queueFile and boxes.finish(state) and boxes.finished():
+                    self._merge(state)
+            finally:
+                boxes.close()
+
+    def _merge(self, state):
+        '''
+            merges the partitions of a multi-node harvest into csvFileName
+        '''
+        if state != 'done':
+            self.onMessage(f"{self.node} stopped before writing its partition", logging.WARNING)
+        self.onMessage(f"all nodes stopped; merging partitions into {self.csvFileName}")
+        try:
+            with self.metrics.timer('merge'):
+                merge_partitions(self.csvFileName, self.UNIQUE_KEY)
+        except (OSError, ValueError) as ex:
+            self.onError(f"Error: could not merge partitions: {ex}")
+        self.onMetrics(self.metrics.snapshot())
+
+    def _finish(self, csvFileName):
+        '''
+            deduplicates the harvested photos, adds hometowns and writes the csv file
+        '''
+        if self.failed:
+            return pd.DataFrame()
+
+        if not self.running:
+            return self._halt_error()
+
+        self.onMessage(f"Finished downloading all {self.totalRecordCount} records")
+
+        self.onMessage('dropping duplicates...')
+
+        try:
+            with self.metrics.timer('deduplicate'):
+                self.df = pd.DataFrame(self.csvData, columns=self.csvKeys)
+
+                self.onMessage(f"found {self.df.shape[0] - self.df[self.UNIQUE_KEY].unique().shape[0]} duplicates. dropping...")
+
+                self.df.drop_duplicates(subset=[self.UNIQUE_KEY], inplace=True)
+
+            del self.csvData
+        except Exception as ex:
+            self.onMessage(str(ex), logging.WARNING)
+
+        # one profile request per owner, spread over the key pool
+        owners = self.df['owner'].unique()
+        with ThreadPoolExecutor(max_workers=len(self.apiKeys) * THREADS_PER_KEY) as executor:
+            hometowns = dict(zip(owners, executor.map(self._get_user_data, owners)))
+        self.df['user_hometown'] = self.df['owner'].map(hometowns)
+
+        self.onMessage("flushing data into csv file...")
+        try:
+            # newline='' leaves line endings to pandas on every platform
+            with self.metrics.timer('csv_write'), open(csvFileName, 'w', newline='') as f:
+                self.df.to_csv(f)
+        except Exception as ex:
+            self.onError(f"Error : {ex}")
+            return pd.DataFrame()
+        else:
+            self.onMessage("csv file saved")
+
+        self.onMetrics(self.metrics.snapshot())
+
+        self.running = False
+        return self.df
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+
+ pool of flickr API keys shared by the harvest threads; every key has its own
+ request budget and is retired for a while when flickr refuses it
+"""
+
+import time
+import threading
+
+from .constants import KEY_RATE_LIMIT, KEY_BURST, KEY_MAX_FAILURES, KEY_RETIRE_TIME, KEY_MAX_RETIRE_TIME, \
+    KEY_INVALID_CODE, KEY_RATE_LIMITED_CODE
+
+
+class ApiKey:
+    '''
+        state of one key: token bucket, consecutive failures and retirement
+    '''
+    def __init__(self, key, rate, burst):
+        self.key = key
+        # requests per second; None for no budget
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+        self.requests = 0
+        self.failures = 0
+        self.strikes = 0
+        # monotonic time the key is usable again; None if permanently retired
+        self.retiredUntil = 0.0
+
+    @property
+    def label(self):
+        # never log a whole key
+        return f"{self.key[:6]}..."
+
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        '''
+            seconds until the key may send a request; None if it never will
+        '''
+        if self.retiredUntil is None:
+            return None
+        if self.retiredUntil > now:
+            return self.retiredUntil - now
+        if self.rate is None or self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class KeyPool:
+    '''
+        hands out API keys to harvest threads
+
+        - every key refills KEY_RATE_LIMIT tokens an hour up to KEY_BURST; a request
+          takes a token from the key with the most of them, so load spreads evenly
+          and throughput grows with the number of keys
+        - keys rejected as invalid are retired for good
+        - keys over their rate limit, or failing KEY_MAX_FAILURES times in a row, are
+          retired for KEY_RETIRE_TIME seconds, doubling on every retirement
+    '''
+    def __init__(self, keys, ratePerHour=KEY_RATE_LIMIT, burst=KEY_BURST, onMessage=None):
+        if len(keys) == 0:
+            raise ValueError("key pool needs at least one API key")
+
+        rate = ratePerHour / 3600 if ratePerHour else None
+        self.keys = [ApiKey(key, rate, burst) for key in dict.fromkeys(keys)]
+        self.onMessage = onMessage or (lambda *args: None)
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def exhausted(self):
+        '''
+            True when every key is permanently retired
+        '''
+        with self._cond:
+            return all(apiKey.retiredUntil is None for apiKey in self.keys)
+
+    def acquire(self, timeout=None):
+        '''
+            takes one request from the budget of the best key, waiting for one if needed
+
+            Returns:
+                the key; None on timeout or when every key is permanently retired
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                best, wait = None, None
+                for apiKey in self.keys:
+                    apiKey.refill(now)
+                    keyWait = apiKey.wait_time(now)
+                    if keyWait is None:
+                        continue
+                    if wait is None or keyWait < wait or (keyWait == wait and apiKey.tokens > best.tokens):
+                        best, wait = apiKey, keyWait
+
+                if best is None:
+                    return None
+
+                if wait == 0:
+                    best.tokens -= 1
+                    best.requests += 1
+                    return best.key
+
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = min(wait, deadline - now)
+                self._cond.wait(wait)
+
+    def _find(self, key):
+        for apiKey in self.keys:
+            if apiKey.key == key:
+                return apiKey
+        raise KeyError(key)
+
+    def retire(self, key, permanent=False):
+        with self._cond:
+            apiKey = self._find(key)
+            if apiKey.retiredUntil is None:
+                # rejected for good; a late report from a request in flight must not bring it back
+                return
+            if permanent:
+                apiKey.retiredUntil = None
+                self.onMessage(f"API key {apiKey.label} rejected; removed from the pool")
+            else:
+                apiKey.strikes += 1
+                period = min(KEY_RETIRE_TIME * 2 ** (apiKey.strikes - 1), KEY_MAX_RETIRE_TIME)
+                apiKey.retiredUntil = time.monotonic() + period
+                apiKey.failures = 0
+                self.onMessage(f"API key {apiKey.label} retired for {period:.0f}s")
+            self._cond.notify_all()
+
+    def report(self, key, data):
+        '''
+            updates the health of a key from the response of one request
+
+            Input:
+                key: key the request was sent with
+                data: decoded response; None when the request failed without one
+
+            Returns:
+                True if the key was retired because of this response
+        '''
+        if data is None:
+            return False
+
+        if data.get('stat', None) != 'fail':
+            with self._cond:
+                apiKey = self._find(key)
+                apiKey.failures = 0
+                apiKey.strikes = 0
+            return False
+
+        code = data.get('code', None)
+        if code == KEY_INVALID_CODE:
+            self.retire(key, permanent=True)
+            return True
+        if code == KEY_RATE_LIMITED_CODE:
+            self.retire(key)
+            return True
+
+        with self._cond:
+            apiKey = self._find(key)
+            apiKey.failures += 1
+            failing = apiKey.failures >= KEY_MAX_FAILURES
+        if failing:
+            self.retire(key)
+        return failing
+
+    def stats(self):
+        '''
+            Returns:
+                requests sent with every key, by key label
+        '''
+        with self._cond:
+            return {apiKey.label: apiKey.requests for apiKey in self.keys}
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+"""
+
+import queue
+import logging
+from collections import deque
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+from .constants import LOG_RING_SIZE, LOG_FILE_SIZE, LOG_FILE_COUNT
+
+LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR
+}
+
+
+class AsyncFileLog:
+    '''
+        rotating log file written by a background thread
+
+        log() only puts the record on a queue; a QueueListener formats it and
+        writes it to disk, rolling over to path.1 ... path.<backupCount> at maxBytes
+    '''
+    def __init__(self, path, maxBytes=LOG_FILE_SIZE, backupCount=LOG_FILE_COUNT):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+
+        self._handler = RotatingFileHandler(path, maxBytes=maxBytes, backupCount=backupCount, encoding='utf-8', delay=True)
+        self._handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(message)s"))
+
+        self._listener = QueueListener(self._queue, self._handler)
+        self._listener.start()
+
+        # standalone logger; not registered with the logging module
+        self._logger = logging.Logger('flickr.logfile', logging.DEBUG)
+        self._logger.addHandler(QueueHandler(self._queue))
+
+    def log(self, level, message):
+        self._logger.log(level, message)
+
+    def close(self):
+        # drains the queue before returning
+        self._listener.stop()
+        self._handler.close()
+
+
+class LogView:
+    '''
+        bounded log shown in a QPlainTextEdit
+
+        - the last `size` lines are kept in a ring buffer together with their level
+        - the widget shows the lines at or above the selected level and never
+          holds more than `size` blocks, so appends cost the same at any run length
+        - when a file log is attached every line is also streamed to it
+    '''
+    def __init__(self, widget, levelBox, size=LOG_RING_SIZE):
+        self.widget = widget
+        self.widget.setReadOnly(True)
+        self.widget.setMaximumBlockCount(size)
+
+        self.lines = deque(maxlen=size)
+        self.level = logging.INFO
+        self.fileLog = None
+
+        self.levelBox = levelBox
+        self.levelBox.addItems(list(LEVELS))
+        self.levelBox.setCurrentText("INFO")
+        self.levelBox.currentTextChanged.connect(self.setLevel)
+
+    def append(self, message, level=logging.INFO):
+        self.extend([(level, message)])
+
+    def extend(self, records):
+        '''
+            Input:
+                records: iterable of (level, message) pairs
+        '''
+        shown = []
+        for level, message in records:
+            self.lines.append((level, message))
+            if self.fileLog is not None:
+                self.fileLog.log(level, message)
+            if level >= self.level:
+                shown.append(message)
+
+        if shown:
+            self.widget.appendPlainText("\n".join(shown))
+
+    def setLevel(self, name):
+        self.level = LEVELS.get(name, logging.INFO)
+        # re-render from the ring buffer
+        self.widget.setPlainText("\n".join(message for level, message in self.lines if level >= self.level))
+        scrollBar = self.widget.verticalScrollBar()
+        scrollBar.setValue(scrollBar.maximum())
+
+    def clear(self):
+        self.lines.clear()
+        self.widget.clear()
+
+    def openFile(self, path):
+        if self.fileLog is None or self.fileLog.path != path:
+            self.closeFile()
+            self.fileLog = AsyncFileLog(path)
+
+    def closeFile(self):
+        if self.fileLog is not None:
+            self.fileLog.close()
+            self.fileLog = None
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+
+ structured instrumentation for harvests: counters, latency histograms,
+ bytes transferred and cache hit ratio; safe to update from several threads
+"""
+
+import json
+import random
+import threading
+import time
+import functools
+from collections import Counter
+from contextlib import contextmanager
+
+from .constants import HISTOGRAM_RESERVOIR
+
+
+def _percentile(samples, q):
+    if not samples:
+        return None
+    return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+class Histogram:
+    '''
+        latency distribution of one stage
+
+        count, total, min and max are exact; percentiles come from a uniform
+        reservoir sample of at most `reservoir` observations
+    '''
+    def __init__(self, reservoir=HISTOGRAM_RESERVOIR):
+        self.reservoir = reservoir
+        self.samples = []
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._rng = random.Random(0)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+        if len(self.samples) < self.reservoir:
+            self.samples.append(value)
+        else:
+            i = self._rng.randrange(self.count)
+            if i < self.reservoir:
+                self.samples[i] = value
+
+    def summary(self):
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "p50": _percentile(samples, 0.50),
+            "p95": _percentile(samples, 0.95),
+            "p99": _percentile(samples, 0.99),
+            "max": self.max
+        }
+
+
+class Metrics:
+    '''
+        collects counters and per stage latencies (seconds) of one harvest
+
+        counters used by the harvester:
+            requests.<name>  : http requests issued
+            bytes.<name>     : bytes received
+            cache.lookups    : searches looked up in the cache, once per search
+                               however many requests it took
+            cache.misses     : lookups the cache did not answer
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.histograms = dict()
+        self.started = time.time()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def observe(self, name, seconds):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def cache_hit_ratio(self):
+        lookups = self.counters.get('cache.lookups', 0)
+        if lookups == 0:
+            return None
+        return 1 - self.counters.get('cache.misses', 0) / lookups
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "elapsed": time.time() - self.started,
+                "counters": dict(self.counters),
+                "latency": {name: histogram.summary() for name, histogram in self.histograms.items()},
+                "bytes": sum(val for key, val in self.counters.items() if key.startswith('bytes.')),
+                "cache_hit_ratio": self.cache_hit_ratio()
+            }
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=4)
+
+
+def timed(name):
+    '''
+        decorator factory timing a method into self.metrics under the given stage name
+    '''
+    def timed_decorator(func):
+        @functools.wraps(func)
+        def func_wrapper(self, *args, **kwargs):
+            with self.metrics.timer(name):
+                return func(self, *args, **kwargs)
+        return func_wrapper
+    return timed_decorator
+
+
+def format_snapshot(snapshot):
+    '''
+        one line summary of a snapshot for the stats panel
+    '''
+    parts = []
+
+    search = snapshot['latency'].get('search_request', None)
+    if search is not None and search['count']:
+        parts.append(f"search {search['count']} req p50 {search['p50'] * 1000:.0f}ms p95 {search['p95'] * 1000:.0f}ms p99 {search['p99'] * 1000:.0f}ms")
+
+    images = snapshot['latency'].get('save_image', None)
+    if images is not None and images['count']:
+        parts.append(f"images {images['count']} p95 {images['p95'] * 1000:.0f}ms")
+
+    parts.append(f"{snapshot['bytes'] / (1024 * 1024):.1f} MB")
+
+    if snapshot['cache_hit_ratio'] is not None:
+        parts.append(f"cache hits {snapshot['cache_hit_ratio'] * 100:.0f}%")
+
+    return " | ".join(parts)
@@ -0,0 +1,596 @@
+import os
+import sqlite3
+import datetime
+import threading
+
+from copy import deepcopy
+
+from utils import _hash_args, _encode_args, _sizeof, set_interval
+from writer import WriteBehind
+from lru import LRUCache
+from serializers import PickleSerializer
+
+from constants import WRITE_INTERVAL, MAX_PENDING_WRITES, L1_MAX_ENTRIES, L1_MAX_BYTES, SQLITE_MAX_VARIABLES, \
+    EVICT_INTERVAL, EPOCH
+
+
+class CacheStats():
+    '''
+        hit, miss and error counters shared by the threads calling a cached function
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'local_hits': 0, 'misses': 0, 'errors': 0, 'oversized': 0, 'evicted': 0, 'expired': 0}
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counts[name] += n
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+def _excess(count, size, max_records, max_bytes):
+    '''
+        Input:
+            count: number of stored entries
+            size: bytes of stored entries
+            max_records, max_bytes: limits; None for no limit
+
+        Returns:
+            number of entries to evict, assuming entries of the average size
+    '''
+    keep = count
+    if max_records is not None:
+        keep = min(keep, max_records)
+    if max_bytes is not None and size > max_bytes:
+        keep = min(keep, int(count * max_bytes / size))
+    return max(count - keep, 0)
+
+
+class CacheBackend():
+    '''
+        storage behind the cache decorator
+
+        the base class keeps the in process LRU, the write behind queue and the
+        statistics; a backend implements
+            _connect()                      : open the store, disable the cache if it fails
+            _get(args)                      : stored document {response, timestamp} or None
+            _entry(data, args)              : entry to insert for a result
+            _update_entry(data, args)       : (filter, entry) pair to upsert for a result
+            _write_batch(inserts, updates)  : write entries to the store
+            _touch_batch(accessed)          : store the last access time of entries
+            _evict(max_records, max_bytes)  : remove least recently used entries past the limits
+        and may override
+            _purge(oldest)                  : remove entries made before oldest; with ttl
+            _prepare(data, args)            : called before the first write of a result
+            _entry_time(entry)              : datetime an entry was made
+
+        results are stored as the bytes of serializer; with no serializer a
+        backend stores them as they are
+
+        with max_records or max_bytes, the least recently used entries are evicted
+        every evict_interval seconds. hits only note their access time in memory;
+        the times are written in one batch before evicting. results larger than
+        max_entry_size pickled bytes are not stored
+
+        entries older than shelf_life are filtered out by the query itself. with
+        ttl they are also removed from the store: by the server where it can
+        expire them, otherwise every evict_interval seconds
+    '''
+    def __init__(self, shelf_life, logger=print, write_behind=True, write_interval=WRITE_INTERVAL, \
+                 max_pending=MAX_PENDING_WRITES, l1_max_entries=L1_MAX_ENTRIES, l1_max_bytes=L1_MAX_BYTES, \
+                 max_records=None, max_bytes=None, max_entry_size=None, evict_interval=EVICT_INTERVAL, ttl=False, \
+                 serializer=None):
+        self._SHELF_LIFE = shelf_life
+        self._serializer = serializer
+        # entries never go stale with the default shelf life
+        self._ttl = ttl and self._oldest() is not None
+
+        self._enabled = True
+        self.logger = logger
+        self.stats = CacheStats()
+
+        self._connected = False
+        # guards connection and backend metadata
+        self._lock = threading.RLock()
+
+        self._write_behind = write_behind
+        self._write_interval = write_interval
+        self._max_pending = max_pending
+        self.writer = None
+
+        # in process level 1 cache in front of the store
+        self.local = LRUCache(shelf_life, max_entries=l1_max_entries, max_bytes=l1_max_bytes)
+
+        self._max_records = max_records
+        self._max_bytes = max_bytes
+        self._max_entry_size = max_entry_size
+        self._evict_interval = evict_interval
+        self._evictor = None
+
+        # access times of hits not written yet, by key
+        self._accessed = {}
+        self._accessed_lock = threading.Lock()
+
+    @property
+    def bounded(self):
+        return self._max_records is not None or self._max_bytes is not None
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def disable_cache(self):
+        self._enabled = False
+
+    @property
+    def connected(self):
+        return self._connected
+
+    def connect(self):
+        '''
+            opens the store once; called on first use so that decorating a
+            function never blocks on the store
+        '''
+        if self._connected:
+            return
+
+        with self._lock:
+            if self._connected:
+                return
+
+            self._connect()
+
+            if self._enabled and self._write_behind:
+                self.writer = WriteBehind(self._write_batch, logger=self.logger, \
+                                          interval=self._write_interval, max_pending=self._max_pending)
+            if self._enabled and (self.bounded or self._ttl):
+                self._evictor = set_interval(self.evict, self._evict_interval)
+            self._connected = True
+
+    def flush(self):
+        '''
+            writes the entries still waiting for the writer thread
+        '''
+        if self.writer is not None:
+            self.writer.flush()
+
+    def _fresh(self, timestamp):
+        return datetime.datetime.now() - timestamp <= self._SHELF_LIFE
+
+    def _oldest(self):
+        '''
+            Returns:
+                time of the oldest fresh entry; None if entries never go stale
+        '''
+        try:
+            oldest = datetime.datetime.now() - self._SHELF_LIFE
+        except OverflowError:
+            return None
+        return oldest if oldest > EPOCH else None
+
+    def pending(self, args):
+        '''
+            Returns:
+                the entry queued for args but not written yet; None if there is none or it is stale
+        '''
+        if self.writer is None:
+            return None
+
+        entry = self.writer.pending(repr(args))
+        if entry is None or not self._fresh(self._entry_time(entry)):
+            return None
+        return entry
+
+    def _touch(self, args):
+        if self.bounded:
+            with self._accessed_lock:
+                self._accessed[repr(args)] = (args, datetime.datetime.now())
+
+    def evict(self):
+        '''
+            removes stale entries with ttl, writes pending access times, then
+            evicts least recently used entries past max_records and max_bytes;
+            runs on the evictor thread
+        '''
+        if not self._enabled:
+            return
+
+        with self._accessed_lock:
+            accessed, self._accessed = list(self._accessed.values()), {}
+
+        try:
+            if self._ttl:
+                expired = self._purge(self._oldest())
+                if expired > 0:
+                    self.stats.count('expired', expired)
+                    self.logger(f"removed {expired} stale cache entries")
+
+            if len(accessed) > 0:
+                self._touch_batch(accessed)
+
+            evicted = self._evict(self._max_records, self._max_bytes) if self.bounded else 0
+        except Exception as ex:
+            self.logger("error evicting cache entries", ex)
+            return
+
+        if evicted > 0:
+            self.stats.count('evicted', evicted)
+            self.logger(f"evicted {evicted} cache entries")
+
+    def _get_local(self, args):
+        response = self.local.get(repr(args), None)
+        if response is not None:
+            self.stats.count('local_hits')
+            self._touch(args)
+            return {'response': response}
+
+        entry = self.pending(args)
+        if entry is not None:
+            return {'response': self._result(entry['response'])}
+        return None
+
+    def _accept(self, args, document):
+        if document is None:
+            return None
+
+        # check if data is stale
+        if not self._fresh(document['timestamp']):
+            return None
+
+        # keep a copy in process, as old as the stored one
+        self.local.put(repr(args), document.get('response', None), document['timestamp'])
+        self._touch(args)
+        del document['timestamp']
+        return document
+
+    def get(self, args):
+        '''
+            looks a result up in process, then among the entries waiting for the
+            writer, then in the store
+
+            Returns:
+                document holding the result under 'response'; None on a miss
+        '''
+        document = self._get_local(args)
+        if document is not None:
+            return document
+
+        return self._accept(args, self._get(args))
+
+    def get_many(self, calls):
+        '''
+            looks many results up with one query to the store
+
+            Input:
+                calls: list of argument tuples
+
+            Returns:
+                hits: list of (args, result), in the order found
+                misses: list of args without a fresh result
+        '''
+        hits, lookups = [], []
+        for args in calls:
+            document = self._get_local(args)
+            if document is not None:
+                hits.append((args, document['response']))
+            else:
+                lookups.append(args)
+
+        misses = []
+        if len(lookups) > 0:
+            for args, document in zip(lookups, self._get_many(lookups)):
+                document = self._accept(args, document)
+                if document is not None:
+                    hits.append((args, document['response']))
+                else:
+                    misses.append(args)
+        return hits, misses
+
+    def put(self, data, args):
+        '''
+            Inputs:
+                data : function output data to cache
+                args : inputs to function
+        '''
+        self.put_many([(args, data)])
+
+    def put_many(self, results):
+        '''
+            stores many results with one write to the store
+
+            Input:
+                results: list of (args, data)
+        '''
+        if not self._enabled or len(results) == 0:
+            return
+
+        self.logger('cacheing data')
+        try:
+            entries = []
+            for args, data in results:
+                if self._oversized(data):
+                    continue
+                self.local.put(repr(args), data)
+                self._prepare(data, args)
+                entries.append((args, self._entry(data, args)))
+
+            if self.writer is not None:
+                for args, entry in entries:
+                    self.writer.insert(repr(args), entry)
+            else:
+                self._write_batch([entry for _, entry in entries], [])
+        except Exception as ex:
+            self.logger("error cacheing data", ex)
+            self.disable_cache()
+
+    def overwrite(self, data, args):
+        if not self._enabled:
+            return
+
+        try:
+            if self._oversized(data):
+                return
+            self.local.put(repr(args), data)
+            self._prepare(data, args)
+
+            filter, entry = self._update_entry(data, args)
+
+            if self.writer is not None:
+                self.writer.update(repr(args), filter, entry)
+            else:
+                self._write_batch([], [(filter, entry)])
+        except Exception as ex:
+            self.logger("error overwriting data", ex)
+            self.disable_cache()
+
+    def _oversized(self, data):
+        if self._max_entry_size is None or _sizeof(data) <= self._max_entry_size:
+            return False
+        self.stats.count('oversized')
+        self.logger("result larger than max_entry_size...not cached")
+        return True
+
+    def _response(self, data):
+        '''
+            Returns:
+                the stored form of a result
+        '''
+        if self._serializer is not None:
+            return self._serializer.dumps(data)
+
+        # make copy of data for processing and cacheing
+        # do not alter original output
+        return deepcopy(data)
+
+    def _result(self, response):
+        '''
+            Returns:
+                a result from its stored form
+        '''
+        if self._serializer is not None:
+            return self._serializer.loads(response)
+        return deepcopy(response)
+
+    def _prepare(self, data, args):
+        pass
+
+    def _purge(self, oldest):
+        '''
+            Returns:
+                number of entries removed
+        '''
+        return 0
+
+    def _entry_time(self, entry):
+        return entry['timestamp']
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _get(self, args):
+        raise NotImplementedError
+
+    def _get_many(self, calls):
+        '''
+            Returns:
+                stored document or None for every call; backends override this
+                to look them up with one query
+        '''
+        return [self._get(args) for args in calls]
+
+    def _entry(self, data, args):
+        raise NotImplementedError
+
+    def _update_entry(self, data, args):
+        raise NotImplementedError
+
+    def _write_batch(self, inserts, updates):
+        raise NotImplementedError
+
+    def _touch_batch(self, accessed):
+        '''
+            Input:
+                accessed: list of (args, datetime of last access)
+        '''
+        raise NotImplementedError
+
+    def _evict(self, max_records, max_bytes):
+        '''
+            Returns:
+                number of entries evicted
+        '''
+        raise NotImplementedError
+
+
+class SqliteCache(CacheBackend):
+    '''
+        local cache in one sqlite file; needs no server
+
+        every result is one row keyed by a hash of the arguments, holding the
+        arguments for inspection and the serialized result
+    '''
+    def __init__(self, path, table_name, shelf_life, hash_func=None, **kwargs):
+        super().__init__(shelf_life, **kwargs)
+        if self._serializer is None:
+            # rows hold bytes only
+            self._serializer = PickleSerializer()
+        self._PATH = path
+        self._TABLE_NAME = table_name
+        self._hash_func = hash_func or _hash_args
+
+        self._db = None
+        # one connection shared by the callers and the writer thread
+        self._db_lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            folder = os.path.dirname(self._PATH)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+
+            self._db = sqlite3.connect(self._PATH, timeout=30, check_same_thread=False, isolation_level=None)
+            # readers do not wait for the writer
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self._TABLE_NAME}" ('
+                'key TEXT PRIMARY KEY, args TEXT, response BLOB, timestamp REAL, accessed REAL)'
+            )
+            # tables made before eviction have no access times
+            columns = [row[1] for row in self._db.execute(f'PRAGMA table_info("{self._TABLE_NAME}")')]
+            if 'accessed' not in columns:
+                self._db.execute(f'ALTER TABLE "{self._TABLE_NAME}" ADD COLUMN accessed REAL')
+            self._db.execute(
+                f'CREATE INDEX IF NOT EXISTS "{self._TABLE_NAME}_accessed" ON "{self._TABLE_NAME}" (accessed)'
+            )
+            if self._ttl:
+                self._db.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{self._TABLE_NAME}_timestamp" ON "{self._TABLE_NAME}" (timestamp)'
+                )
+        except sqlite3.Error as ex:
+            self.logger("could not open cache file...cacheing disabled", ex)
+            self.disable_cache()
+
+    def _get(self, args):
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    f'SELECT response, timestamp FROM "{self._TABLE_NAME}" WHERE key = ? AND timestamp >= ?',
+                    (self._hash_func(args), self._oldest_timestamp())
+                ).fetchone()
+        except sqlite3.Error as ex:
+            self.logger("disabling cache", ex)
+            self.disable_cache()
+            return None
+
+        if row is None:
+            return None
+        return {'response': self._result(row[0]), 'timestamp': datetime.datetime.fromtimestamp(row[1])}
+
+    def _oldest_timestamp(self):
+        # stale rows are never read
+        oldest = self._oldest()
+        return oldest.timestamp() if oldest is not None else 0.0
+
+    def _get_many(self, calls):
+        keys = [self._hash_func(args) for args in calls]
+        oldest = self._oldest_timestamp()
+        rows = {}
+        try:
+            with self._db_lock:
+                # stay under the sqlite limit of bound variables
+                for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                    chunk = keys[i:i + SQLITE_MAX_VARIABLES]
+                    rows.update((row[0], row[1:]) for row in self._db.execute(
+                        f'SELECT key, response, timestamp FROM "{self._TABLE_NAME}" '
+                        f'WHERE key IN ({",".join("?" * len(chunk))}) AND timestamp >= ?', chunk + [oldest]
+                    ))
+        except sqlite3.Error as ex:
+            self.logger("disabling cache", ex)
+            self.disable_cache()
+            return [None] * len(calls)
+
+        return [
+            {'response': self._result(rows[key][0]), 'timestamp': datetime.datetime.fromtimestamp(rows[key][1])}
+            if key in rows else None
+            for key in keys
+        ]
+
+    def _entry(self, data, args):
+        return {
+            'key': self._hash_func(args),
+            'args': _encode_args(args),
+            'response': self._response(data),
+            'timestamp': datetime.datetime.now()
+        }
+
+    def _update_entry(self, data, args):
+        entry = self._entry(data, args)
+        return entry['key'], entry
+
+    def _write_batch(self, inserts, updates):
+        if not self._enabled:
+            return
+
+        # the newest result of a key wins
+        rows = [
+            (entry['key'], entry['args'], entry['response'], entry['timestamp'].timestamp(),
+             entry['timestamp'].timestamp())
+            for entry in inserts + [entry for _, entry in updates]
+        ]
+        try:
+            self._executemany(
+                f'INSERT OR REPLACE INTO "{self._TABLE_NAME}" (key, args, response, timestamp, accessed) '
+                'VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+        except sqlite3.Error as ex:
+            self.logger("error cacheing data", ex)
+            self.disable_cache()
+
+    def _touch_batch(self, accessed):
+        rows = [(time.timestamp(), self._hash_func(args)) for args, time in accessed]
+        try:
+            self._executemany(f'UPDATE "{self._TABLE_NAME}" SET accessed = ? WHERE key = ?', rows)
+        except sqlite3.Error as ex:
+            self.logger("error writing access times", ex)
+            self.disable_cache()
+
+    def _executemany(self, sql, rows):
+        '''
+            runs sql for every row in one transaction, rolled back if any of it fails
+            so the shared connection is never left inside a transaction
+        '''
+        with self._db_lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(sql, rows)
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                raise
+
+    def _purge(self, oldest):
+        with self._db_lock:
+            return self._db.execute(
+                f'DELETE FROM "{self._TABLE_NAME}" WHERE timestamp < ?', (oldest.timestamp(),)
+            ).rowcount
+
+    def _evict(self, max_records, max_bytes):
+        with self._db_lock:
+            count, size = self._db.execute(
+                f'SELECT COUNT(*), COALESCE(SUM(LENGTH(response)), 0) FROM "{self._TABLE_NAME}"'
+            ).fetchone()
+
+            excess = _excess(count, size, max_records, max_bytes)
+            if excess > 0:
+                # freed pages are reused by later writes
+                self._db.execute(
+                    f'DELETE FROM "{self._TABLE_NAME}" WHERE key IN '
+                    f'(SELECT key FROM "{self._TABLE_NAME}" ORDER BY accessed LIMIT ?)', (excess,)
+                )
+        return excess
@@ -1,3 +1,4 @@
+import os
 import datetime
 import re
 
@@ -8,6 +9,40 @@ from utils import _coerce_decimal128, _coerce_float, _coerce_timestamp, _coerce_
 
 INDEX_NAME = 'mongocache_index'
 
+ACCESSED_INDEX_NAME = 'mongocache_accessed'
+EXPIRES_INDEX_NAME = 'mongocache_expires'
+
+# single indexed key of collections with hashed keys
+HASH_KEY_NAME = 'key_hash'
+
+# milliseconds to wait for the server before the cache is disabled
+SERVER_SELECTION_TIMEOUT = 2000
+
+# entries are never older than this; a day past the unix epoch is safe in every time zone
+EPOCH = datetime.datetime(1970, 1, 2)
+
+# zlib level of serialized results; 1 is the fastest
+COMPRESSION_LEVEL = 1
+
+# seconds between evictions of caches with max_records or max_bytes
+EVICT_INTERVAL = 60.0
+
+# most keys in one sqlite IN (...) lookup
+SQLITE_MAX_VARIABLES = 500
+
+# folder of local cache files
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mongocache")
+
+# write behind: seconds between flushes, queued entries before the caller
+# flushes itself, and entries per insert_many / bulk_write
+WRITE_INTERVAL = 1.0
+MAX_PENDING_WRITES = 1000
+WRITE_BATCH_SIZE = 100
+
+# in process cache: most entries and most pickled bytes kept
+L1_MAX_ENTRIES = 256
+L1_MAX_BYTES = 64 * 1024 * 1024
+
 ATOMIC_BSON_TYPES = {
     int     : 'int',
     float   : 'decimal', 
@@ -15,7 +50,7 @@ ATOMIC_BSON_TYPES = {
     bool    : 'bool', 
     datetime.datetime   : 'date', 
     re.Pattern          : 'regex',
-    bytes               : 'binary'
+    bytes               : 'binData'
 }
 
 '''
@@ -0,0 +1,94 @@
+import pickle
+import datetime
+import threading
+
+from collections import OrderedDict
+
+from constants import L1_MAX_ENTRIES, L1_MAX_BYTES
+
+
+class LRUCache():
+    '''
+        in-process cache in front of the collection
+
+        values are kept pickled, so a hit hands out a fresh copy the caller may
+        alter and the size of every entry is known. least recently used entries
+        are evicted past max_entries or max_bytes
+    '''
+    def __init__(self, shelf_life, max_entries=L1_MAX_ENTRIES, max_bytes=L1_MAX_BYTES):
+        self._shelf_life = shelf_life
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+
+        # key -> (pickled value, timestamp)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._max_entries > 0 and self._max_bytes > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def get(self, key, default=None):
+        '''
+            Returns:
+                a copy of the value stored under key; default if there is none or it is stale
+        '''
+        with self._lock:
+            item = self._entries.get(key, None)
+            if item is None:
+                return default
+
+            blob, timestamp = item
+            if datetime.datetime.now() - timestamp > self._shelf_life:
+                self._remove(key)
+                return default
+
+            self._entries.move_to_end(key)
+
+        return pickle.loads(blob)
+
+    def put(self, key, value, timestamp=None):
+        '''
+            Input:
+                key: hashable key
+                value: picklable value
+                timestamp: time the value was computed; defaults to now
+        '''
+        if not self.enabled:
+            return
+
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # unpicklable values are left to the collection
+            return
+
+        if len(blob) > self._max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (blob, timestamp or datetime.datetime.now())
+            self._bytes += len(blob)
+
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        blob, _ = self._entries.pop(key)
+        self._bytes -= len(blob)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
@@ -3,62 +3,149 @@
     TODO: implement strict mode
     TODO: implement null handling - ALMOST DONE - EDGE CASE TESTING TBD
     TODO: error logging and warning logging
-    TODO: make thread safe
+    TODO: make thread safe - DONE
     TODO: implement stale data definition: shelf_life - DONE
     TODO: implement all functionalities from cachier
-    TODO: allow both remote and local cacheing
-    TODO: allow user to define serializer
+    TODO: allow both remote and local cacheing - DONE
+    TODO: allow user to define serializer - DONE
     TODO: enforce datatype (args, kwargs) and return types to be non-null
     TODO: ignore self argument - DONE
-    TODO: support for unhashable types
-    TODO: move data push and update to another thread
-    TODO: max records
-    TODO: max entry size allowed
-    TODO: fallback
+    TODO: support for unhashable types - DONE
+    TODO: move data push and update to another thread - DONE
+    TODO: max records - DONE
+    TODO: max entry size allowed - DONE
+    TODO: fallback - DONE
 '''
 
+import os
 import pymongo
 import datetime
 import json
+import threading
 
-from copy import deepcopy
 
 from bson.decimal128 import Decimal128
 from bson.timestamp import Timestamp
 
 from utils import _coerce_decimal128, _coerce_float, _coerce_timestamp, _coerce_datetime, \
-    _func_is_method
+    _func_is_method, _hash_args, _encode_args
+from backends import CacheBackend, SqliteCache, _excess
+from serializers import PickleSerializer
 
-from constants import ATOMIC_BSON_TYPES, ATOMIC_BSON_CONVERTERS, ATOMIC_PYTHON_CONVERTERS, BUILTIN_ITERABLES
+from constants import ATOMIC_BSON_TYPES, ATOMIC_BSON_CONVERTERS, ATOMIC_PYTHON_CONVERTERS, BUILTIN_ITERABLES, \
+    WRITE_INTERVAL, MAX_PENDING_WRITES, L1_MAX_ENTRIES, L1_MAX_BYTES, CACHE_DIR, SERVER_SELECTION_TIMEOUT, \
+    HASH_KEY_NAME, ACCESSED_INDEX_NAME, EXPIRES_INDEX_NAME, EVICT_INTERVAL
 
 
 def mongocache(db_name, collection_name, port=27017, schema=None, strict=True, \
-               shelf_life=datetime.timedelta.max, logger=print):
+               shelf_life=datetime.timedelta.max, logger=print, write_behind=True, \
+               write_interval=WRITE_INTERVAL, max_pending=MAX_PENDING_WRITES, \
+               l1_max_entries=L1_MAX_ENTRIES, l1_max_bytes=L1_MAX_BYTES, backend="mongo", path=None, \
+               hash_keys=False, hash_func=None, batch=False, max_records=None, max_bytes=None, \
+               max_entry_size=None, evict_interval=EVICT_INTERVAL, ttl=False, serializer=None, \
+               cacheable=None):
     '''
         decorator factory callable that creates and returns the wrapper decorator
+
+        with write_behind, results are written by a background thread every
+        write_interval seconds instead of on the caller's thread
+
+        the most recently used results, up to l1_max_entries and l1_max_bytes, are
+        also kept in process and served without a query; 0 turns that off
+
+        backend is where results are stored:
+            mongo   : collection collection_name of database db_name on localhost:port
+            sqlite  : table collection_name of the sqlite file path, by default
+                      db_name.sqlite in CACHE_DIR; needs no server
+            auto    : mongo, falling back to sqlite when the server is not reachable
+
+        with hash_keys, mongo stores the arguments hashed by hash_func (sha256 of
+        their canonical json by default) into one indexed key, keeping their json
+        for inspection. any argument type is then supported. an existing collection
+        keeps the key layout it was created with
+
+        with batch, the function takes a list of argument tuples as its last
+        argument and returns a list of results. the cache answers every call it
+        can with one query and the function only gets the rest
+
+        the wrapper's get_many(calls) looks argument tuples up with one query and
+        returns the hits as (args, result) pairs and the misses separately;
+        put_many(results) stores (args, result) pairs computed for those misses
+
+        max_records and max_bytes bound the stored entries; the least recently
+        used ones are evicted every evict_interval seconds. results larger than
+        max_entry_size pickled bytes are not cached
+
+        results older than shelf_life are filtered out by the query; with ttl
+        they are also deleted, by a TTL index in mongo and every evict_interval
+        seconds in sqlite
+
+        serializer turns results into the bytes stored; PickleSerializer (zlib
+        compressed pickle) by default. "bson" stores mongo results as documents,
+        coercing every float to Decimal128
+
+        cacheable(result) decides which results are stored; the others are
+        returned but computed again on the next call. by default every result
+        but None is stored
     '''
     sentinel = object()
 
-    # hit-miss statistics
-    hits, misses, errors = 0, 0, 0
+    options = dict(logger=logger, write_behind=write_behind, write_interval=write_interval, \
+                   max_pending=max_pending, l1_max_entries=l1_max_entries, l1_max_bytes=l1_max_bytes, \
+                   max_records=max_records, max_bytes=max_bytes, max_entry_size=max_entry_size, \
+                   evict_interval=evict_interval, ttl=ttl, \
+                   serializer=None if serializer == "bson" else serializer or PickleSerializer())
 
-    cache = MongoCache(port, db_name, collection_name, shelf_life, logger=logger, schema=schema)
+    if path is None:
+        path = os.path.join(CACHE_DIR, f"{db_name}.sqlite")
+
+    if hash_keys and hash_func is None:
+        hash_func = _hash_args
+
+    if cacheable is None:
+        cacheable = lambda data: data is not None
+
+    if backend == "sqlite":
+        cache = SqliteCache(path, collection_name, shelf_life, hash_func=hash_func, **options)
+    elif backend in ("mongo", "auto"):
+        cache = MongoCache(port, db_name, collection_name, shelf_life, schema=schema, hash_func=hash_func, **options)
+    else:
+        raise ValueError(f"unknown cache backend {backend}")
+
+    cache_lock = threading.Lock()
+
+    def connect():
+        '''
+            connect on the first cached call rather than at decoration time
+        '''
+        nonlocal cache
+
+        if cache.connected:
+            return cache
+
+        with cache_lock:
+            cache.connect()
+            if backend == "auto" and not cache.enabled:
+                logger("falling back to local cache", path)
+                cache = SqliteCache(path, collection_name, shelf_life, hash_func=hash_func, **options)
+                cache.connect()
+        return cache
 
     def mongo_decorator(func):
         def func_wrapper(*args, **kwargs):
-            nonlocal schema
-            nonlocal hits, misses, errors, sentinel
+            nonlocal sentinel
             nonlocal func
-            nonlocal cache
 
             # runtime function call arguments
             ignore_cache = kwargs.pop('ignore_index', False)
             overwrite_cache = kwargs.pop('overwrite_cache', False)
 
-            # TODO: make collection object creation thread safe
-            # after they are created in a thread safe manner thread safety for all operations
-            # on the collection object is implemented by mongoDB
-            if cache.enabled and not ignore_cache:
+            if ignore_cache:
+                return func(*args, **kwargs)
+
+            cache = connect()
+
+            if cache.enabled:
                 data = sentinel
 
                 # get list of arguments including kwargs sorted according to key
@@ -68,115 +155,202 @@ def mongocache(db_name, collection_name, port=27017, schema=None, strict=True, \
                 if _func_is_method(func):
                     all_args = all_args[1:]
 
-                if cache.collection is None:
-                    '''on first function call create a collection if not already created'''
-
-                    # create key names on first call
-                    cache.key_names = tuple([f"key_{i}" for i in range(len(all_args))])
-
-                    # get function output to cache
+                if overwrite_cache:
                     data = func(*args, **kwargs)
-
-                    # create schema from data and key_names if not given
-                    if schema is None:
-                        cache._create_schema(data, all_args)
-
-                    # create collection
-                    cache._create_collection()
-                    logger("created new collection")
-
-                    # push data
-                    cache._push_data(data, all_args)
+                    if cacheable(data):
+                        cache.overwrite(data, all_args)
                 else:
-                    # get key names from collection
-                    cache.key_names = cache._get_keynames()
+                    # query cache
+                    document = cache.get(all_args)
 
-                    if overwrite_cache:
-                        data = func(*args, **kwargs)
-                        cache._update_data(data, all_args)
-                    else:
-                        # query cache
-                        document = cache._query(all_args)                
-
-                        # update hit miss statistics
-                        if document is not None:
-                            data = document.get('response', sentinel)
-                            if data is not sentinel:
-                                logger("cache hit")
-                                hits += 1
-                            else:
-                                errors += 1
+                    # entries stored before cacheable rejected them are replaced
+                    stored = False
+
+                    # update hit miss statistics
+                    if document is not None:
+                        data = document.get('response', sentinel)
+                        if data is sentinel:
+                            cache.stats.count('errors')
+                        elif cacheable(data):
+                            logger("cache hit")
+                            cache.stats.count('hits')
                         else:
-                            ''' cache miss '''
                             data = sentinel
-                            logger("cache miss")
-                            misses += 1
-
+                            stored = True
+                            cache.stats.count('misses')
+                    else:
+                        ''' cache miss '''
+                        logger("cache miss")
+                        cache.stats.count('misses')
 
-                        if data is sentinel:
-                            '''cache miss - call function and cache output'''
-                            data = func(*args, **kwargs)
-                            cache._push_data(data, all_args)
+                    if data is sentinel:
+                        '''cache miss - call function and cache output'''
+                        data = func(*args, **kwargs)
+                        if cacheable(data):
+                            if stored:
+                                cache.overwrite(data, all_args)
+                            else:
+                                cache.put(data, all_args)
 
                 return data
             else:
                 '''cache is disabled'''
                 return func(*args, **kwargs)
-        
-        return func_wrapper
+
+        def batch_wrapper(*args, **kwargs):
+            ignore_cache = kwargs.pop('ignore_index', False)
+
+            if ignore_cache:
+                return func(*args, **kwargs)
+
+            # leading arguments (self) are passed through; the last one is the list of calls
+            *head, calls = args
+            calls = [tuple(call) for call in calls]
+
+            hits, misses, rejected = lookup(calls)
+            results = {repr(call): data for call, data in hits}
+            misses = misses + rejected
+
+            cache = connect()
+
+            if len(misses) > 0:
+                '''cache miss - call function for the rest and cache outputs'''
+                cache.stats.count('misses', len(misses))
+                computed = func(*head, misses, **kwargs)
+                stored = set(repr(call) for call in rejected)
+                results.update((repr(call), data) for call, data in zip(misses, computed))
+
+                computed = [(call, data) for call, data in zip(misses, computed) if cacheable(data)]
+                cache.put_many([(call, data) for call, data in computed if repr(call) not in stored])
+                for call, data in computed:
+                    if repr(call) in stored:
+                        cache.overwrite(data, call)
+
+            return [results[repr(call)] for call in calls]
+
+        wrapper = batch_wrapper if batch else func_wrapper
+        wrapper.get_cache = lambda: cache
+        wrapper.cache_stats = lambda: cache.stats.as_dict()
+        wrapper.get_many = get_many
+        wrapper.put_many = put_many
+        return wrapper
+
+    def get_many(calls):
+        '''
+            Input:
+                calls: list of argument tuples, without self
+
+            Returns:
+                hits: list of (args, result)
+                misses: list of args to compute
+        '''
+        hits, misses, rejected = lookup(calls)
+        return hits, misses + rejected
+
+    def put_many(results):
+        '''
+            stores results computed without the wrapper, such as those of the misses
+            get_many returned, with one write
+
+            Input:
+                results: list of (args, result), without self
+        '''
+        cache = connect()
+        cache.put_many([(tuple(call), data) for call, data in results if cacheable(data)])
+
+    def lookup(calls):
+        '''
+            Returns:
+                hits: list of (args, result)
+                misses: list of args not stored
+                rejected: list of args whose stored result cacheable rejects
+        '''
+        cache = connect()
+        if not cache.enabled:
+            return [], list(calls), []
+
+        hits, misses = cache.get_many([tuple(call) for call in calls])
+        # entries stored before cacheable rejected them are computed again
+        rejected = [call for call, data in hits if not cacheable(data)]
+        hits = [(call, data) for call, data in hits if cacheable(data)]
+        # misses are counted by the call that computes them
+        cache.stats.count('hits', len(hits))
+        logger(f"{len(hits)} cache hits, {len(misses) + len(rejected)} cache misses")
+        return hits, misses, rejected
+
     return mongo_decorator
 
 
-class MongoCache():
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _shared_client(port):
+    '''
+        Returns:
+            the client for port, shared by every cache of the process
+            MongoClient is thread safe and pools its own connections
+    '''
+    with _clients_lock:
+        if port not in _clients:
+            _clients[port] = pymongo.MongoClient("localhost", port, serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT)
+        return _clients[port]
+
+
+class MongoCache(CacheBackend):
     _INDEX_NAME = 'mongocache_index'
 
-    def __init__(self, port, db_name, collection_name, shelf_life, logger=print, schema=None, hash_func=None):
+    def __init__(self, port, db_name, collection_name, shelf_life, schema=None, hash_func=None, **kwargs):
+        super().__init__(shelf_life, **kwargs)
         self._PORT = port
         self._DB_NAME = db_name
         self._COLLECTION_NAME = collection_name
         self._SCHEMA = schema
-        self._SHELF_LIFE = shelf_life
 
-        self._enabled = True
         self._key_names = []
+        # key names are read from the index once and kept until the collection is recreated
+        self._key_names_loaded = False
         self.mongo_op_object = dict()
 
         self._hash_func = hash_func
 
         self.collection = None
+        self.client = None
+        self._accessed_indexed = False
 
-        self.logger = logger
-
+    def _connect(self):
         self._test_connection()
 
-    @property
-    def enabled(self):
-        return self._enabled
-
-    def disable_cache(self):
-        self._enabled = False
-
     def _test_connection(self):
         # test connection and check if collection exists from previous calls
         try:
             # create connection
-            client = pymongo.MongoClient("localhost", self._PORT)
+            self.client = _shared_client(self._PORT)
+
+            # create database if not exists
+            self.db = self.client[self._DB_NAME]
+
+            # check if collection exists
+            # the client connects lazily; this is the first call to reach the server
+            collection_names = self.db.list_collection_names()
         except:
             # connection failed
             # log error and disable cacheing
             self.logger("connection failed...cacheing disabled ")
             self.disable_cache()
         else:
-            # create database if not exists
-            self.db = client[self._DB_NAME]
-
-            # check if collection exists
-            if self._COLLECTION_NAME in self.db.list_collection_names():
+            if self._COLLECTION_NAME in collection_names:
                 self.collection = self.db[self._COLLECTION_NAME]
-            
-            if self.collection is None:
-                # close connection...recreate connection lazily later when wrapped function is called 
-                client.close()
+                if self._ttl:
+                    self._create_ttl_index()
+
+    def _create_ttl_index(self):
+        # the server deletes entries once their expiry date passes
+        try:
+            self.collection.create_index([("expires", pymongo.ASCENDING)], expireAfterSeconds=0, \
+                                         name=EXPIRES_INDEX_NAME)
+        except Exception as ex:
+            self.logger("could not create ttl index", ex)
 
     @property
     def key_names(self):
@@ -186,6 +360,81 @@ class MongoCache():
     def key_names(self, value):
         self._key_names = value
 
+    def _prepare(self, data, args):
+        if self.collection is None:
+            self._initialize(data, args)
+        else:
+            self._load_keynames()
+
+    def _initialize(self, data, args):
+        '''
+            creates key names, schema and collection from the first call
+
+            Input:
+                data: output of the first call
+                args: arguments of the first call
+        '''
+        with self._lock:
+            if self.collection is not None:
+                return
+
+            # create key names on first call
+            if self._hash_func is not None:
+                self.key_names = (HASH_KEY_NAME,)
+            else:
+                self.key_names = tuple([f"key_{i}" for i in range(len(args))])
+            self._key_names_loaded = True
+
+            # create schema from data and key_names if not given
+            if self._SCHEMA is None:
+                self._create_schema(data, args)
+
+            # create collection
+            self._create_collection()
+            self.logger("created new collection")
+
+    def _load_keynames(self):
+        if self._key_names_loaded:
+            return
+
+        with self._lock:
+            if self._key_names_loaded:
+                return
+
+            key_names = self._get_keynames()
+            if key_names is not None:
+                self.key_names = key_names
+                self._key_names_loaded = True
+
+    def invalidate(self):
+        '''
+            forgets the collection and its key names; the next call creates the
+            collection again. call after dropping the collection
+        '''
+        with self._lock:
+            self.collection = None
+            self._key_names_loaded = False
+
+    def _keyed(self):
+        '''
+            Returns:
+                False when the key names are unknown; an empty key filter would match any entry
+        '''
+        return self._enabled and len(self.key_names) > 0
+
+    @property
+    def hashed(self):
+        return HASH_KEY_NAME in self.key_names
+
+    def _keys(self, args):
+        '''
+            Returns:
+                key fields of an entry for args
+        '''
+        if self.hashed:
+            return {HASH_KEY_NAME: (self._hash_func or _hash_args)(args)}
+        return {key: val for key, val in zip(self.key_names, args)}
+
     def _get_keynames(self):
         index_info = self.collection.index_information().get(self._INDEX_NAME, None)
 
@@ -273,12 +522,9 @@ class MongoCache():
         '''
 
         # construct entry
-        entry = {}
-
-        for key_name, arg in zip(self.key_names, args):
-            entry[key_name] = arg
+        entry = self._keys(args)
 
-        entry['response'] = data
+        entry.update(self._stored(data))
 
         self.logger(entry)
 
@@ -303,6 +549,9 @@ class MongoCache():
         schema['properties'].update({
             "timestamp": {
                 "bsonType": "timestamp"
+            },
+            "accessed": {
+                "bsonType": "date"
             }
         })
 
@@ -325,7 +574,7 @@ class MongoCache():
 
         try:
             # create database
-            self.client = pymongo.MongoClient("localhost", self._PORT)
+            self.client = _shared_client(self._PORT)
             self.db = self.client[self._DB_NAME]
 
             self.logger("created database")
@@ -348,6 +597,12 @@ class MongoCache():
             indices = [(key, pymongo.ASCENDING) for key in self.key_names] + [("timestamp", pymongo.DESCENDING)]
             self.collection.create_index(indices, unique=True, name=self._INDEX_NAME)
 
+            # least recently used entries are evicted first
+            self.collection.create_index([("accessed", pymongo.ASCENDING)], name=ACCESSED_INDEX_NAME)
+
+            if self._ttl:
+                self._create_ttl_index()
+
             self.logger("created index")
         except Exception as ex:
             # log error
@@ -386,6 +641,10 @@ class MongoCache():
         data = self._deserialize(data)
         
         del data['_id']
+
+        # results stored by a serializer
+        if data.pop('serializer', None) is not None:
+            data['response'] = (self._serializer or PickleSerializer()).loads(data['response'])
         # del data['timestamp']
 
         return data
@@ -394,15 +653,16 @@ class MongoCache():
         '''
             recursively iterate through the data structure
             and convert pythonic builtin data types to BSON format
+
+            builds new containers: queued entries are read by callers while
+            the writer thread serializes them
         '''
         if type(data) in ATOMIC_BSON_CONVERTERS:
             return ATOMIC_BSON_CONVERTERS[type(data)](data)
         elif type(data) in BUILTIN_ITERABLES:
             return [self._coerce_bson_recursive(item) for item in data]
         elif type(data) == dict:
-            for key, val in data.items():
-                data[key] = self._coerce_bson_recursive(val)
-            return data
+            return {key: self._coerce_bson_recursive(val) for key, val in data.items()}
         return data
 
     def _serialize(self, data):
@@ -413,14 +673,25 @@ class MongoCache():
                 raw function output data to be cached
 
             Returns:
-                data with coerced format
+                a copy of data with coerced format
         '''
         data = self._coerce_bson_recursive(data)
         return data
 
+    def _get(self, args):
+        if self.collection is None:
+            return None
+
+        # get key names from collection; resolved once per collection
+        self._load_keynames()
+        if not self._keyed():
+            return None
+        return self._query(args)
+
     def _query(self,args):
         try:
-            query = {key: self._serialize(val) for key, val in zip(self.key_names, args)}
+            query = self._serialize(self._keys(args))
+            query.update(self._freshness())
             cursor = self.collection.find(query)
             docs = list(cursor)
 
@@ -431,12 +702,7 @@ class MongoCache():
 
                 self.logger(document['timestamp'])
 
-                # check if data is stale
-                if datetime.datetime.now() - document['timestamp'] <= self._SHELF_LIFE:
-                    del document['timestamp']
-                    return document
-                else:
-                    return None
+                return document
             else:
                 return None
         except Exception as ex:
@@ -444,8 +710,55 @@ class MongoCache():
             self.disable_cache()
             return None
 
+    def _get_many(self, calls):
+        if self.collection is None:
+            return [None] * len(calls)
+
+        self._load_keynames()
+        if not self._keyed():
+            return [None] * len(calls)
+        try:
+            keys = [self._serialize(self._keys(args)) for args in calls]
+            if self.hashed:
+                query = {HASH_KEY_NAME: {'$in': [key[HASH_KEY_NAME] for key in keys]}}
+            else:
+                query = {'$or': keys}
+            query.update(self._freshness())
+            docs = list(self.collection.find(query))
+
+            # match documents back to the calls they answer
+            documents = []
+            for key in keys:
+                doc = next((doc for doc in docs if all(doc.get(name, None) == val for name, val in key.items())), None)
+                documents.append(self._process_query(dict(doc)) if doc is not None else None)
+            return documents
+        except Exception as ex:
+            self.logger("disabling cache", ex)
+            self.disable_cache()
+            return [None] * len(calls)
+
+    def _freshness(self):
+        '''
+            Returns:
+                query clause selecting fresh entries only, so stale ones never cross the wire
+        '''
+        oldest = self._oldest()
+        if oldest is None:
+            return {}
+        return {'timestamp': {'$gte': _coerce_timestamp(oldest, 0)}}
+
+    def _expiry(self, timestamp):
+        if not self._ttl:
+            return {}
+        # TTL indexes compare against utc dates
+        return {'expires': timestamp.astimezone(datetime.timezone.utc) + self._SHELF_LIFE}
+
     def _get_timestamp(self):
         # add timestamp and inc
+        with self._lock:
+            return self._next_timestamp()
+
+    def _next_timestamp(self):
         timestamp = datetime.datetime.now()
 
         last_second = self.mongo_op_object.get("second", -1)
@@ -462,50 +775,101 @@ class MongoCache():
 
         return timestamp, op_count
 
-    def _update_data(self, data, args):
-        try:
-            # make copy of data for processing and cacheing
-            # do not alter original output
-            data = deepcopy(data)
+    def _entry(self, data, args):
+        entry = self._keys(args)
+        if self.hashed:
+            # arguments are kept for inspection only; they are not indexed
+            entry['args'] = _encode_args(args)
 
-            filter = self._serialize({key: val for key, val in zip(self.key_names, args)})
+        entry.update(self._stored(data))
 
-            update = {"$set": {
-                'response': self._serialize(data), 
-                'timestamp': _coerce_timestamp(*self._get_timestamp())
-            }}
+        # add timestamp
+        timestamp, inc = self._get_timestamp()
+        entry['timestamp'] = _coerce_timestamp(timestamp, inc)
+        entry['accessed'] = timestamp
+        entry.update(self._expiry(timestamp))
+        return entry
 
-            # update and upsert
-            self.collection.update_one(filter, update, upsert=True)
-        except Exception as ex:
-            self.logger("error overwriting data", ex)
-            self.disable_cache()
-
-    def _push_data(self, data, args):
+    def _write_batch(self, inserts, updates):
         '''
-            Inputs:
-                collection : collection object to push data into
-                data : function output data to cache
-                args : inputs to function
+            writes entries to the collection; called by the writer thread
+
+            Input:
+                inserts: entries to insert
+                updates: (filter, entry) pairs to upsert
         '''
         if not self._enabled:
             return
 
-        self.logger('cacheing data')
         try:
-            # make copy of data for processing and cacheing
-            # do not alter original output
-            data = deepcopy(data)
-
-            entry = {key: val for key, val in zip(self.key_names, args)}
-            entry['response'] = data
-
-            # add timestamp
-            entry['timestamp'] = _coerce_timestamp(*self._get_timestamp())
-
-            # coerce data into BSON types mentioned in the schema
-            data = self._serialize(entry)
-            self.collection.insert_one(entry)
+            if len(inserts) > 0:
+                # coerce data into BSON types mentioned in the schema
+                # unordered so that one duplicate does not stop the rest of the batch
+                # collections made with bson results validate them as documents
+                self.collection.insert_many([self._serialize(entry) for entry in inserts], ordered=False, \
+                                            bypass_document_validation=self._serializer is not None)
+
+            if len(updates) > 0:
+                requests = [
+                    pymongo.UpdateOne(self._serialize(filter), {"$set": self._serialize(entry)}, upsert=True)
+                    for filter, entry in updates
+                ]
+                self.collection.bulk_write(requests, ordered=False, \
+                                           bypass_document_validation=self._serializer is not None)
+        except pymongo.errors.BulkWriteError as ex:
+            # entries written concurrently by another process
+            self.logger("skipped duplicate cache entries", len(ex.details.get('writeErrors', [])))
         except Exception as ex:
             self.logger("error cacheing data", ex)
             self.disable_cache()
+
+    def _stored(self, data):
+        '''
+            Returns:
+                result fields of an entry
+        '''
+        if self._serializer is None:
+            return {'response': self._response(data)}
+        return {'response': self._response(data), 'serializer': self._serializer.name}
+
+    def _entry_time(self, entry):
+        return _coerce_datetime(entry['timestamp'])
+
+    def _update_entry(self, data, args):
+        filter = self._keys(args)
+
+        # make copy of data for processing and cacheing
+        # do not alter original output
+        timestamp, inc = self._get_timestamp()
+        entry = self._stored(data)
+        entry.update({'timestamp': _coerce_timestamp(timestamp, inc), 'accessed': timestamp})
+        entry.update(self._expiry(timestamp))
+        return filter, entry
+
+    def _touch_batch(self, accessed):
+        self._load_keynames()
+        if not self._keyed():
+            return
+        requests = [
+            pymongo.UpdateMany(self._serialize(self._keys(args)), {"$set": {'accessed': time}})
+            for args, time in accessed
+        ]
+        self.collection.bulk_write(requests, ordered=False)
+
+    def _evict(self, max_records, max_bytes):
+        if self.collection is None:
+            return 0
+
+        # collections made before eviction have no index on access times
+        if not self._accessed_indexed:
+            self.collection.create_index([("accessed", pymongo.ASCENDING)], name=ACCESSED_INDEX_NAME)
+            self._accessed_indexed = True
+
+        stats = next(self.collection.aggregate([{'$collStats': {'storageStats': {}}}]))['storageStats']
+        excess = _excess(stats['count'], stats['size'], max_records, max_bytes)
+        if excess == 0:
+            return 0
+
+        # entries never accessed since eviction came in sort first
+        ids = [doc['_id'] for doc in self.collection.find({}, {'_id': 1}).sort('accessed', pymongo.ASCENDING).limit(excess)]
+        return self.collection.delete_many({'_id': {'$in': ids}}).deleted_count
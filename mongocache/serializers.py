@@ -0,0 +1,27 @@
+import zlib
+import pickle
+
+from constants import COMPRESSION_LEVEL
+
+
+class PickleSerializer():
+    '''
+        stores a result as one zlib compressed pickle
+
+        lossless for floats and any picklable type, and far cheaper than coercing
+        every value of the result into BSON. a serializer is any object with a
+        name and dumps(data) -> bytes / loads(bytes) -> data
+    '''
+    name = 'pickle+zlib'
+
+    def __init__(self, level=COMPRESSION_LEVEL):
+        self._level = level
+
+    def dumps(self, data):
+        return zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), self._level)
+
+    def loads(self, blob):
+        # plain pickles written before compression start with the PROTO opcode
+        if blob[:1] == b'\x80':
+            return pickle.loads(blob)
+        return pickle.loads(zlib.decompress(blob))
@@ -2,6 +2,9 @@ from decimal import Decimal, localcontext
 import threading
 import time
 import inspect
+import hashlib
+import json
+import pickle
 
 from bson.decimal128 import Decimal128, _decimal_to_128, create_decimal128_context
 from bson.timestamp import Timestamp
@@ -11,13 +14,33 @@ def _func_is_method(func):
     func_params = list(inspect.signature(func).parameters)
     return func_params and func_params[0] == 'self'
 
+def _encode_args(args):
+    '''
+        canonical text of function arguments: equal arguments give equal text
+        types unknown to json are written with their repr
+    '''
+    return json.dumps(args, sort_keys=True, separators=(',', ':'), default=repr)
+
+def _hash_args(args):
+    '''
+        fixed size key for function arguments of any type
+    '''
+    return hashlib.sha256(_encode_args(args).encode('utf-8')).hexdigest()
+
+def _sizeof(data):
+    '''
+        bytes of data once pickled
+    '''
+    return len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
 class set_interval:
     def __init__(self, action, interval):
         self.interval=interval
         self.action=action
         self.stop_event=threading.Event()
 
-        thread=threading.Thread(target=self._set_interval)
+        # daemon, so that an interval never keeps the interpreter alive
+        thread=threading.Thread(target=self._set_interval, daemon=True)
         thread.start()
 
     def _set_interval(self):
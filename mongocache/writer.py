@@ -0,0 +1,120 @@
+import queue
+import atexit
+import threading
+
+from utils import set_interval
+
+from constants import WRITE_INTERVAL, MAX_PENDING_WRITES, WRITE_BATCH_SIZE
+
+
+class WriteBehind():
+    '''
+        background writer for cache entries
+
+        entries are queued by the caller and written in batches by a timer thread,
+        so a cache miss costs the caller only the wrapped function call.
+        the queue is bounded: when it is full the caller flushes it itself
+    '''
+    INSERT, UPDATE = 'insert', 'update'
+
+    def __init__(self, write, logger=print, interval=WRITE_INTERVAL, max_pending=MAX_PENDING_WRITES, \
+                 batch_size=WRITE_BATCH_SIZE):
+        '''
+            Input:
+                write: callable taking a list of entries to insert and a list of
+                       (filter, entry) pairs to upsert
+                logger: log callable
+                interval: seconds between flushes
+                max_pending: maximum number of queued entries
+                batch_size: maximum number of entries per write
+        '''
+        self._write = write
+        self.logger = logger
+        self._batch_size = batch_size
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        # entries not written yet by key, so that a lookup never misses its own write
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # one flush at a time keeps batches in queue order
+        self._flush_lock = threading.Lock()
+
+        self._timer = set_interval(self.flush, interval)
+        self._closed = False
+        atexit.register(self.close)
+
+    def insert(self, key, entry):
+        self._put(key, (self.INSERT, None, entry))
+
+    def update(self, key, filter, entry):
+        self._put(key, (self.UPDATE, filter, entry))
+
+    def _put(self, key, op):
+        if self._closed:
+            self._write(*self._split([op]))
+            return
+
+        with self._pending_lock:
+            self._pending[key] = op[2]
+
+        while True:
+            try:
+                self._queue.put_nowait((key, op))
+                return
+            except queue.Full:
+                # writer is behind; write a batch on the caller's thread
+                self.flush(max_batches=1)
+
+    def pending(self, key):
+        '''
+            Returns:
+                the entry queued under key; None if there is none
+        '''
+        with self._pending_lock:
+            return self._pending.get(key, None)
+
+    def _split(self, ops):
+        inserts = [entry for kind, _, entry in ops if kind == self.INSERT]
+        updates = [(filter, entry) for kind, filter, entry in ops if kind == self.UPDATE]
+        return inserts, updates
+
+    def flush(self, max_batches=None):
+        '''
+            writes queued entries in batches of batch_size
+
+            Input:
+                max_batches: stop after this many batches; None to empty the queue
+        '''
+        with self._flush_lock:
+            batches = 0
+            while max_batches is None or batches < max_batches:
+                batch = []
+                while len(batch) < self._batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                if len(batch) == 0:
+                    return
+
+                try:
+                    self._write(*self._split([op for _, op in batch]))
+                except Exception as ex:
+                    self.logger("error writing cache entries", ex)
+                finally:
+                    with self._pending_lock:
+                        for key, op in batch:
+                            if self._pending.get(key, None) is op[2]:
+                                del self._pending[key]
+                batches += 1
+
+    def close(self):
+        '''
+            stops the timer and writes everything still queued
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        self._timer.cancel()
+        self.flush()
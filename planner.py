@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+
+ dry run of a harvest: explores the box subdivision tree with one result
+ probes and estimates what the real harvest will cost
+"""
+
+import json
+import math
+import logging
+import threading
+from datetime import datetime
+
+from .harvester import Harvester, split_box
+from .boxqueue import BoxQueue
+from .metrics import timed
+from .constants import RES_PER_PAGE, MAX_SAME_QUERIES, KEY_RATE_LIMIT, THREADS_PER_KEY, AVERAGE_IMAGE_BYTES
+
+
+class Planner(Harvester):
+    '''
+        walks the same subdivision tree as Harvester.run, but searches every box
+        with per_page=1 and downloads no pages
+
+        run() returns a plan:
+            boundary        : the planned boundary
+            leaves          : boxes the harvest downloads, with their photo and page counts
+            probes          : probes sent, one per box visited
+            photos          : photos expected
+            search_calls    : searches of a harvest without the plan
+            planned_calls   : searches of a harvest following the plan
+            image_bytes     : estimated bytes of images, if saved
+            wall_time       : estimated seconds of searching under the key budget
+    '''
+    def __init__(self, boundary, apiKey, onMessage=None, onError=None, keyRate=KEY_RATE_LIMIT, area=None):
+        super().__init__(boundary, apiKey, '', '', False, onMessage=onMessage, onError=onError, \
+                         useCache=False, keyRate=keyRate, area=area)
+        self.leaves = []
+        self.branches = 0
+        self._planLock = threading.Lock()
+
+    @timed('probe')
+    def _probe(self, bbox):
+        return self._query(self._search_params(bbox, 1, perPage=1, extras=False), 'probe')
+
+    def _harvest_box(self, bbox, depth, boxes):
+        with self._planLock:
+            self.maxDepth = max(self.maxDepth, depth)
+
+        data = self._probe(bbox)
+
+        if not self.running:
+            return True
+
+        if data is None or data['stat'] == 'fail':
+            # leave the box to the harvest, which searches it as usual
+            self.onMessage("probe failed; box left unplanned", logging.WARNING)
+            with self._planLock:
+                self.leaves.append({"bbox": bbox, "depth": depth, "photos": None, "pages": None})
+            return True
+
+        photos = int(data['photos']['total'])
+        boxes.observe(bbox, photos)
+        if photos == 0:
+            if depth == 0:
+                self.onError('no results found within given box')
+                return False
+            return True
+
+        pages = math.ceil(photos / RES_PER_PAGE)
+        if pages > MAX_SAME_QUERIES:
+            children, how = split_box(bbox)
+            self.onMessage(f"{photos} photos. dividing {how}...", logging.DEBUG)
+            with self._planLock:
+                self.branches += 1
+            for child in children:
+                boxes.put(child, depth + 1)
+        else:
+            with self._planLock:
+                self.leaves.append({"bbox": bbox, "depth": depth, "photos": photos, "pages": pages})
+        return True
+
+    def run(self):
+        '''
+            Returns:
+                the plan; None on error or when halted
+        '''
+        self.leaves = []
+        self.branches = 0
+
+        if not self._start():
+            return None
+
+        self.onMessage("planning harvest...")
+        boxes = BoxQueue()
+        boxes.seed(self.boundary)
+        self._work(boxes)
+
+        if self.failed or not self.running:
+            return None
+        self.running = False
+
+        # unplanned boxes are counted as one search
+        photos = sum(leaf['photos'] or 0 for leaf in self.leaves)
+        plannedCalls = sum(leaf['pages'] or 1 for leaf in self.leaves)
+
+        probe = self.metrics.histograms.get('probe_request', None)
+        latency = probe.total / probe.count if probe is not None and probe.count else 0.0
+        threads = len(self.apiKeys) * THREADS_PER_KEY
+        wallTime = plannedCalls * latency / threads
+        if self.keyRate:
+            # keys rejected while planning do not count
+            usableKeys = max(sum(1 for apiKey in self.keyPool.keys if apiKey.retiredUntil is not None), 1)
+            wallTime = max(wallTime, plannedCalls / (usableKeys * self.keyRate / 3600))
+
+        return {
+            "boundary": list(self.boundary),
+            "leaves": sorted(self.leaves, key=lambda leaf: leaf['depth']),
+            "probes": self.metrics.counters.get('requests.probe', 0),
+            "depth": self.maxDepth,
+            "photos": photos,
+            "search_calls": self.branches + plannedCalls,
+            "planned_calls": plannedCalls,
+            "image_bytes": photos * AVERAGE_IMAGE_BYTES,
+            "wall_time": wallTime
+        }
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value)} is not serializable")
+
+
+def save_plan(plan, path):
+    with open(path, 'w') as f:
+        json.dump(plan, f, indent=4, default=_encode)
+
+
+def _decode_box(bbox):
+    return bbox[:4] + [datetime.fromisoformat(date) for date in bbox[4:]]
+
+
+def load_plan(path):
+    with open(path) as f:
+        plan = json.load(f)
+
+    plan['boundary'] = _decode_box(plan['boundary'])
+    for leaf in plan['leaves']:
+        leaf['bbox'] = _decode_box(leaf['bbox'])
+    return plan
+
+
+def format_plan(plan):
+    '''
+        report of a plan for the command line
+    '''
+    hours, rest = divmod(int(plan['wall_time']), 3600)
+    return "\n".join([
+        f"leaf boxes      : {len(plan['leaves'])} (depth {plan['depth']})",
+        f"photos          : {plan['photos']}",
+        f"probes sent     : {plan['probes']}",
+        f"search calls    : {plan['search_calls']} ({plan['planned_calls']} following this plan)",
+        f"profile calls   : at most {plan['photos']}",
+        f"image bytes     : {plan['image_bytes'] / (1024 * 1024):.1f} MB",
+        f"search time     : {hours}h {rest // 60}m {rest % 60}s"
+    ])
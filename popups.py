@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ FlickrForQgis
+ A QGIS plugin
+ ***************************************************************************/
+"""
+
+import os
+from collections import OrderedDict
+from datetime import datetime
+
+from qgis.PyQt.QtCore import QUrl
+from qgis.PyQt.QtNetwork import QNetworkAccessManager, QNetworkDiskCache, QNetworkRequest
+from PyQt5.QtWebKitWidgets import QWebView
+
+from .constants import POPUP_POOL_SIZE, POPUP_CACHE_SIZE
+
+
+html_template_file = open(os.path.join(os.path.dirname(__file__), 'template.html'))
+html_template = html_template_file.read()
+html_template_file.close()
+
+
+def _format_date(datetaken):
+    return datetime.strptime(datetaken, "%Y-%m-%d %H:%M:%S").strftime('%A, %d %B, %Y')
+
+
+def resolve_image(link, filepath):
+    '''
+        prefers the image saved by the harvest over the remote flickr url
+    '''
+    if isinstance(filepath, str) and len(filepath) and os.path.isfile(filepath):
+        return QUrl.fromLocalFile(filepath).toString()
+    return link
+
+
+def render_popup(title, tags, datetaken, link, ownername, filepath=''):
+    '''
+        fills the popup template with the attributes of a single feature
+    '''
+    link = resolve_image(link, filepath)
+
+    if len(title) == 0:
+        title = "no title"
+    if len(tags.strip(" ")) != 0:
+        tags = str(['"' + tag + '"' for tag in tags.strip().split(" ")])
+    else:
+        tags = []
+
+    return html_template.format(title, link, title, _format_date(datetaken), ownername, tags)
+
+
+class CachingNetworkAccessManager(QNetworkAccessManager):
+    '''
+        network access manager that serves requests from its disk cache whenever possible
+        so reopened photos load instantly and without a connection
+    '''
+    def createRequest(self, op, request, outgoingData=None):
+        request = QNetworkRequest(request)
+        request.setAttribute(QNetworkRequest.CacheLoadControlAttribute, QNetworkRequest.PreferCache)
+        return super().createRequest(op, request, outgoingData)
+
+
+class PopupManager:
+    '''
+        bounded pool of reusable web views for photo popups
+
+        - at most pool_size views are ever created; the setup cost of a view is paid once
+        - views are keyed by feature id; reselecting a feature reuses its view
+        - when the pool is full the least recently used view is recycled
+        - all views share one network access manager backed by a size limited disk cache
+    '''
+    def __init__(self, pool_size=POPUP_POOL_SIZE, cacheDir=None, cacheSize=POPUP_CACHE_SIZE):
+        self.pool_size = pool_size
+
+        self.networkManager = CachingNetworkAccessManager()
+        if cacheDir is not None:
+            diskCache = QNetworkDiskCache(self.networkManager)
+            diskCache.setCacheDirectory(cacheDir)
+            diskCache.setMaximumCacheSize(cacheSize)
+            self.networkManager.setCache(diskCache)
+
+        # local images are only loadable from a file:// base url
+        self.baseUrl = QUrl.fromLocalFile(os.path.dirname(__file__) + os.sep)
+
+        # feature id -> web view, least recently used first
+        self._views = OrderedDict()
+
+    def _create_view(self):
+        webView = QWebView()
+        webView.page().setNetworkAccessManager(self.networkManager)
+        webView.resize(600, 700)
+        return webView
+
+    def _acquire(self, key):
+        if key in self._views:
+            self._views.move_to_end(key)
+            return self._views[key], False
+
+        if len(self._views) < self.pool_size:
+            webView = self._create_view()
+        else:
+            # recycle least recently used view
+            _, webView = self._views.popitem(last=False)
+
+        self._views[key] = webView
+        return webView, True
+
+    def show_feature(self, key, attrs):
+        webView, stale = self._acquire(key)
+        if stale:
+            webView.setHtml(render_popup(*attrs), self.baseUrl)
+        webView.show()
+        webView.raise_()
+
+    def close_all(self):
+        for webView in self._views.values():
+            try:
+                webView.close()
+            except:
+                pass
+
+    def clear(self):
+        '''
+            closes and releases every pooled view
+        '''
+        self.close_all()
+        for webView in self._views.values():
+            webView.deleteLater()
+        self._views.clear()